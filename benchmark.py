@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from aiohttp import web
+
+ROBLOX_HOSTS = ["users", "presence", "badges", "friends", "groups", "thumbnails"]
+SCENARIOS = ["data", "setxp", "leaderboard", "ticket"]
+ARTIC_KINGDOM_ID = 11592051
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark bot commands against a local stand-in for the Roblox and XP APIs.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=5, help="commands per simulated user")
+    parser.add_argument("--players", type=int, default=200, help="distinct Roblox accounts to draw usernames from")
+    parser.add_argument("--latency", type=float, default=50, help="mean upstream latency in ms")
+    parser.add_argument("--jitter", type=float, default=20, help="upstream latency standard deviation in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream requests answered with 503")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--unlimited", action="store_true", help="lift the per-host rate limits so only latency bounds throughput")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    return parser.parse_args()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def player_id(name):
+    match = re.fullmatch(r"player(\d+)", name.lower())
+    return int(match.group(1)) + 1000 if match else None
+
+class FakeUpstream:
+    def __init__(self, args, port):
+        self.args = args
+        self.port = port
+        self.hits = Counter()
+        self.path_counts = Counter()
+        self.bio_codes = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.loop = None
+        self.runner = None
+
+    def rng(self, request):
+        # Seeded per request path and occurrence so runs see the same latencies regardless of scheduling.
+        with self.lock:
+            self.path_counts[request.path_qs] += 1
+            occurrence = self.path_counts[request.path_qs]
+        return random.Random(f"{self.args.seed}:{request.method}:{request.path_qs}:{occurrence}")
+
+    @web.middleware
+    async def simulate(self, request, handler):
+        rng = self.rng(request)
+        with self.lock:
+            self.hits[request.path.split("/")[1]] += 1
+        await asyncio.sleep(max(rng.gauss(self.args.latency, self.args.jitter), 0) / 1000)
+        if rng.random() < self.args.error_rate:
+            return web.json_response({"error": "injected failure"}, status=503)
+        return await handler(request)
+
+    def app(self):
+        app = web.Application(middlewares=[self.simulate])
+        app.router.add_get("/users/v1/users/{id}", self.profile)
+        app.router.add_post("/users/v1/usernames/users", self.usernames)
+        app.router.add_post("/presence/v1/presence/users", self.presence)
+        app.router.add_post("/presence/v1/presence/last-online", self.last_online)
+        app.router.add_get("/badges/v1/users/{id}/badges/awarded-dates", self.badges)
+        app.router.add_get("/friends/v1/users/{id}/friends/count", self.friends)
+        app.router.add_get("/groups/v2/users/{id}/groups/roles", self.group_roles)
+        app.router.add_get("/thumbnails/v1/users/avatar-headshot", self.headshot)
+        app.router.add_get("/api/get_user_data", self.user_data)
+        app.router.add_post("/api/set_xp", self.set_xp)
+        app.router.add_get("/api/leaderboard", self.leaderboard)
+        app.router.add_get("/api/get_role_id", self.role_id)
+        app.router.add_post("/api/set_group_rank", self.set_group_rank)
+        return app
+
+    async def profile(self, request):
+        user_id = int(request.match_info["id"])
+        return web.json_response({
+            "id": user_id,
+            "name": f"Player{user_id - 1000}",
+            "displayName": f"Player {user_id - 1000}",
+            "created": "2019-03-04T05:06:07.000Z",
+            "description": self.bio_codes.get(user_id, "")
+        })
+
+    async def usernames(self, request):
+        body = await request.json()
+        data = [{"requestedUsername": name, "id": player_id(name), "name": name} for name in body["usernames"] if player_id(name)]
+        return web.json_response({"data": data})
+
+    async def presence(self, request):
+        body = await request.json()
+        return web.json_response({"userPresences": [
+            {"userId": user_id, "userPresenceType": user_id % 4, "lastOnline": "2024-06-01T12:00:00.000Z" if user_id % 8 else None}
+            for user_id in body["userIds"]
+        ]})
+
+    async def last_online(self, request):
+        body = await request.json()
+        return web.json_response({"lastOnlineTimestamps": [{"userId": user_id, "lastOnline": "2024-05-01T08:00:00.000Z"} for user_id in body["userIds"]]})
+
+    async def badges(self, request):
+        user_id = int(request.match_info["id"])
+        data = [{"badgeId": int(request.query["badgeIds"]), "awardedDate": "2021-07-08T09:10:11.000Z"}] if user_id % 3 else []
+        return web.json_response({"data": data})
+
+    async def friends(self, request):
+        return web.json_response({"count": int(request.match_info["id"]) % 200})
+
+    async def group_roles(self, request):
+        return web.json_response({"data": [
+            {"group": {"id": 7444608}, "role": {"id": 1, "name": "Member", "rank": 1}},
+            {"group": {"id": ARTIC_KINGDOM_ID}, "role": {"id": 9, "name": "Knight", "rank": 50}}
+        ]})
+
+    async def headshot(self, request):
+        return web.json_response({"data": [{"targetId": int(request.query["userIds"]), "imageUrl": "https://tr.rbxcdn.com/fake.png"}]})
+
+    async def user_data(self, request):
+        user_id = player_id(request.query["username"])
+        if not user_id:
+            return web.json_response({"error": "User not found"})
+        return web.json_response({"userId": user_id, "xp": user_id * 3, "offenseData": {}, "last_updated": "2024-06-01T00:00:00"})
+
+    async def set_xp(self, request):
+        body = await request.json()
+        return web.json_response({"newXp": body["xp"]})
+
+    async def leaderboard(self, request):
+        etag = f'"{self.args.seed}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        players = [{"username": f"Player{i}", "xp": 100000 - i * 37} for i in range(self.args.players)]
+        return web.json_response({"leaderboard": players}, headers={"ETag": etag})
+
+    async def role_id(self, request):
+        return web.json_response({"roleId": 5})
+
+    async def set_group_rank(self, request):
+        return web.json_response({"status": "success"})
+
+    def serve(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        self.loop.run_until_complete(web.TCPSite(self.runner, "127.0.0.1", self.port).start())
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        self.ready.wait()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def take_hits(self):
+        with self.lock:
+            hits, self.hits = self.hits, Counter()
+        return hits
+
+class FakeMessage:
+    def __init__(self, content, channel, author):
+        self.content = content
+        self.channel = channel
+        self.author = author
+        self.attachments = []
+
+    async def edit(self, **kwargs):
+        pass
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.messages = []
+        self.embeds = []
+
+    async def send(self, content=None, embed=None, view=None, file=None):
+        self.messages.append(content or "")
+        if embed is not None:
+            self.embeds.append(embed)
+        return FakeMessage(content, self, None)
+
+class FakeContext(FakeChannel):
+    def __init__(self, channel_id, user):
+        super().__init__(channel_id)
+        self.author = user
+        self.message = FakeMessage("", self, user)
+
+class FakeInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.guild_id = 1
+
+class LoopMonitor:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self.task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(time.perf_counter() - start - self.interval, 0))
+
+    def start(self):
+        self.lags = []
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        return self.lags
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+async def run_ticket(bot_module, fake, channel_id, username):
+    user = FakeUser(channel_id)
+    channel = FakeChannel(channel_id)
+
+    # Each step runs to completion inside the dispatcher, so its replies are already sent when it returns.
+    async def reply(content):
+        sent = len(channel.messages)
+        await bot_module.dispatch_ticket_message(FakeMessage(content, channel, user))
+        return "\n".join(channel.messages[sent:])
+
+    await bot_module.handle_ticket(channel, FakeInteraction(user))
+    code = re.search(r"`(\w+)`", await reply(username))
+    if not code:
+        return False
+    # Concurrent tickets may verify the same account, so codes accumulate like a bio edited twice.
+    fake.bio_codes[player_id(username)] = f"{fake.bio_codes.get(player_id(username), 'hello')} {code.group(1)}"
+    ranks = await reply("confirm")
+    choice = next((line.split(":")[0] for line in ranks.splitlines() if "Artic's Kingdom" in line), None)
+    if choice is None:
+        return False
+    return "Successfully transferred" in await reply(choice)
+
+async def run_scenario(bot_module, fake, args, scenario):
+    rng = random.Random(f"{args.seed}:{scenario}")
+    plans = [[f"Player{rng.randrange(args.players)}" for _ in range(args.iterations)] for _ in range(args.users)]
+    latencies = []
+    failures = 0
+
+    async def simulate_user(index, usernames):
+        nonlocal failures
+        for iteration, username in enumerate(usernames):
+            ctx = FakeContext(index * 1000 + iteration, FakeUser(index))
+            start = time.perf_counter()
+            try:
+                # Commands report upstream errors as a reply, so success is judged by what they sent.
+                if scenario == "data":
+                    await bot_module.data.callback(ctx, "roblox", username)
+                    ok = bool(ctx.embeds)
+                elif scenario == "setxp":
+                    await bot_module.setxp.callback(ctx, "roblox", username, 1234)
+                    ok = any(message.startswith("Successfully set") for message in ctx.messages)
+                elif scenario == "leaderboard":
+                    await bot_module.leaderboard.callback(ctx, "roblox", 1 + iteration % 3)
+                    ok = bool(ctx.embeds)
+                else:
+                    ok = await run_ticket(bot_module, fake, 10**6 + index * 1000 + iteration, username)
+                if not ok:
+                    failures += 1
+                    if scenario != "ticket":
+                        print(f"{scenario} failed for {username}: {' | '.join(ctx.messages)!r}", file=sys.stderr)
+            except Exception as e:
+                failures += 1
+                print(f"{scenario} failed for {username}: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - start)
+
+    bot_module.response_cache.clear()
+    bot_module.leaderboard_cache.snapshot = None
+    bot_module.leaderboard_cache.etag = bot_module.leaderboard_cache.last_modified = None
+    bot_module.db.execute("DELETE FROM username_ids")
+    bot_module.db.commit()
+    fake.take_hits()
+    monitor = LoopMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(i, plan) for i, plan in enumerate(plans)))
+    elapsed = time.perf_counter() - started
+    lags = await monitor.stop()
+    hits = fake.take_hits()
+    commands = len(latencies)
+    return {
+        "scenario": scenario,
+        "commands": commands,
+        "failures": failures,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(commands / elapsed, 2) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "requests_per_command": round(sum(hits.values()) / commands, 2) if commands else 0,
+        "requests_by_host": dict(sorted(hits.items())),
+        "loop_lag_max_ms": round(max(lags, default=0) * 1000, 2),
+        "loop_blocked_ms": round(sum(lag for lag in lags if lag > 0.001) * 1000, 2)
+    }
+
+async def run(args, port):
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.chdir(workdir)
+    os.environ["API_BASE_URL"] = f"http://127.0.0.1:{port}/api"
+    os.environ["BOT_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["METRICS_PORT"] = "0"
+    if args.unlimited:
+        os.environ["API_RATE"] = "100000"
+        os.environ["API_BURST"] = "100000"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import discord_bot
+    for host in ROBLOX_HOSTS:
+        discord_bot.http_pool.rewrites[f"https://{host}.roblox.com"] = f"http://127.0.0.1:{port}/{host}"
+        if args.unlimited:
+            discord_bot.HOST_SETTINGS[f"{host}.roblox.com"].update(rate=100000, burst=100000)
+    fake = FakeUpstream(args, port)
+    fake.start()
+    try:
+        results = [await run_scenario(discord_bot, fake, args, scenario) for scenario in args.scenarios.split(",")]
+    finally:
+        await discord_bot.http_pool.close()
+        fake.stop()
+    return results
+
+def main():
+    args = parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.json_path:
+        args.json_path = os.path.abspath(args.json_path)
+    results = asyncio.run(run(args, free_port()))
+    print(f"{'scenario':<12}{'cmds':>6}{'fail':>6}{'cmd/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'req/cmd':>9}{'lag max':>9}{'blocked':>9}")
+    for r in results:
+        print(
+            f"{r['scenario']:<12}{r['commands']:>6}{r['failures']:>6}{r['throughput_per_s']:>9}{r['p50_ms']:>9}"
+            f"{r['p99_ms']:>9}{r['requests_per_command']:>9}{r['loop_lag_max_ms']:>9}{r['loop_blocked_ms']:>9}"
+        )
+    if args.json_path:
+        settings = {k: v for k, v in vars(args).items() if k != "json_path"}
+        with open(args.json_path, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,153 @@
 import os
 import discord
 from discord.ext import commands, tasks
-import requests
+import aiohttp
+from aiohttp import web
 import datetime
 import uuid
 import asyncio
+import atexit
+import bisect
+import contextvars
+import concurrent.futures
+import copy
+import csv
+import functools
+import heapq
+import io
+import json
 import logging
+import logging.handlers
+import queue
+import sqlite3
+import time
+import typing
+from collections import OrderedDict, defaultdict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 
 load_dotenv()
-logging.basicConfig(level=logging.INFO, filename='discord_bot.log', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+LOG_FILE = os.getenv("LOG_FILE", "discord_bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Per call site, at most LOG_THROTTLE_PER_SITE distinct warnings/errors get through each LOG_THROTTLE_WINDOW seconds.
+LOG_THROTTLE_WINDOW = float(os.getenv("LOG_THROTTLE_WINDOW", "60"))
+LOG_THROTTLE_PER_SITE = int(os.getenv("LOG_THROTTLE_PER_SITE", "20"))
+
+log_command = contextvars.ContextVar("log_command", default=None)
+log_user_id = contextvars.ContextVar("log_user_id", default=None)
+
+class LogContextFilter(logging.Filter):
+    # Runs before the record is queued, while the caller's context variables are still visible.
+    def filter(self, record):
+        if getattr(record, "command", None) is None:
+            record.command = log_command.get()
+        if getattr(record, "user_id", None) is None:
+            record.user_id = log_user_id.get()
+        return True
+
+class LogThrottle(logging.Filter):
+    def __init__(self, window, per_site):
+        super().__init__()
+        self.window = window
+        self.per_site = per_site
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        message = record.getMessage()
+        if site is None or record.created - site["started"] >= self.window:
+            suppressed = site["suppressed"] if site else 0
+            self.sites[key] = {"started": record.created, "messages": {message}, "suppressed": 0}
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if message in site["messages"] or len(site["messages"]) >= self.per_site:
+            site["suppressed"] += 1
+            return False
+        site["messages"].add(message)
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    FIELDS = ("command", "user_id", "upstream_host", "latency_ms", "suppressed")
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the record (traceback included) on the caller and drops exc_info.
+    # Only merge the message arguments here and leave the rest to the listener's formatters.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def configure_logging(console=False):
+    # The event loop only enqueues records; traceback and JSON formatting, rotation and disk writes happen on the listener thread.
+    file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonLogFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        handlers.append(console_handler)
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(LogContextFilter())
+    queue_handler.addFilter(LogThrottle(LOG_THROTTLE_WINDOW, LOG_THROTTLE_PER_SITE))
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = configure_logging(console=__name__ == "__main__")
 logger = logging.getLogger('discord_bot')
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix='-', intents=intents)
+# BOT_SHARDS: unset for a single gateway connection, "auto" or a shard count for AutoShardedBot.
+# BOT_SHARD_IDS splits those shards across processes, e.g. BOT_SHARDS=4 with BOT_SHARD_IDS=0,1 and BOT_SHARD_IDS=2,3.
+BOT_SHARDS = os.getenv("BOT_SHARDS", "")
+BOT_SHARD_IDS = [int(shard_id) for shard_id in os.getenv("BOT_SHARD_IDS", "").split(",") if shard_id.strip()]
+# Members are cached as they show up instead of chunking every guild before the bot is ready.
+CHUNK_MEMBERS_AT_STARTUP = os.getenv("CHUNK_MEMBERS_AT_STARTUP", "0") == "1"
+
+if BOT_SHARD_IDS and not BOT_SHARDS.isdigit():
+    raise ValueError("BOT_SHARD_IDS needs BOT_SHARDS set to the total shard count, not 'auto' or unset.")
+
+if BOT_SHARDS:
+    bot = commands.AutoShardedBot(
+        command_prefix='-',
+        intents=intents,
+        chunk_guilds_at_startup=CHUNK_MEMBERS_AT_STARTUP,
+        shard_count=None if BOT_SHARDS == "auto" else int(BOT_SHARDS),
+        shard_ids=BOT_SHARD_IDS or None
+    )
+else:
+    bot = commands.Bot(command_prefix='-', intents=intents, chunk_guilds_at_startup=CHUNK_MEMBERS_AT_STARTUP)
 
 API_BASE_URL = os.getenv("API_BASE_URL", "https://xp-api.onrender.com")
 MAIN_GROUP_ID = 7444608
@@ -26,129 +157,1007 @@ OTHER_KINGDOM_IDS = {
     16132358: "Vinay's Kingdom"
 }
 GAME_BADGE_ID = 123456789
+# (source group, source rank) -> Main Group roleId (as the XP API numbers it) for ranks whose names differ between groups
+RANK_TRANSFER_OVERRIDES = {
+    (11592051, "Receptionist"): 2
+}
+DATA_LOOKUP_DEADLINE = float(os.getenv("DATA_LOOKUP_DEADLINE", "6"))
+UNAVAILABLE = "Unavailable"
+DATA_LOADING = "Loading..."
+# -data sends what it has after DATA_FIRST_PAINT seconds, then edits at most once per DATA_EDIT_INTERVAL.
+DATA_FIRST_PAINT = float(os.getenv("DATA_FIRST_PAINT", "0.3"))
+DATA_EDIT_INTERVAL = float(os.getenv("DATA_EDIT_INTERVAL", "1.5"))
+TIMESTAMP_SENTINELS = frozenset({"N/A", "Not Awarded", "Error", "Unknown", UNAVAILABLE, DATA_LOADING})
+PRESENCE_BATCH_WINDOW = float(os.getenv("PRESENCE_BATCH_WINDOW", "0.025"))
+PRESENCE_BATCH_SIZE = int(os.getenv("PRESENCE_BATCH_SIZE", "50"))
+USERNAME_BATCH_WINDOW = float(os.getenv("USERNAME_BATCH_WINDOW", "0.025"))
+USERNAME_BATCH_SIZE = 100
+USERNAME_TTL = 7 * 86400
+USERNAME_NEGATIVE_TTL = 3600
+BOT_DB_PATH = os.getenv("BOT_DB_PATH", "bot_data.db")
+# Shard processes share responses through BOT_DB_PATH so one process's lookups warm the others.
+SHARED_CACHE = os.getenv("SHARED_CACHE", "1" if BOT_SHARD_IDS else "0") == "1"
+SHARED_CACHE_FLUSH_INTERVAL = 1
+SHARED_CACHE_PURGE_EVERY = 1000
+XP_EDITOR_ROLES = ("Proxy", "Head Proxy", "Vortex", "Noob", "Alaska's Father", "Alaska", "The Queen", "Bacon", "Role Updater")
+BULK_XP_CONCURRENCY = int(os.getenv("BULK_XP_CONCURRENCY", "5"))
+BULK_XP_MAX_ROWS = 500
+PROGRESS_EDIT_INTERVAL = 2
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv("LEADERBOARD_REFRESH_SECONDS", "120"))
+LEADERBOARD_PAGE_SIZE = 10
+TICKET_MAX_RETRIES = 3
+TICKET_STEP_TIMEOUT = 300
+VERIFICATION_TTL = 3600
+RANK_SYNC_MINUTES = float(os.getenv("RANK_SYNC_MINUTES", "30"))
+RANK_SYNC_WORKERS = int(os.getenv("RANK_SYNC_WORKERS", "3"))
+RANK_SYNC_CHUNK = 100
+# Rank lookups the sync keeps in flight; interactive lookups share groups.roblox.com's token bucket.
+RANK_SYNC_FETCH_CONCURRENCY = int(os.getenv("RANK_SYNC_FETCH_CONCURRENCY", "2"))
+RANK_SYNC_MAX_ATTEMPTS = 3
+RANK_SYNC_RETRY_DELAY = 5
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# kind: (seconds a value is fresh, further seconds it may be served stale while it refreshes)
+CACHE_TTLS = {
+    "headshot": (86400, 604800),
+    "profile": (3600, 86400),
+    "badge": (3600, 86400),
+    "friends": (600, 3600),
+    "ranks": (300, 3600),
+    "group_roles": (3600, 86400),
+    "role_id": (3600, 86400),
+    "presence": (30, 30)
+}
+
+UPSTREAM_FAILURE_OUTCOMES = ("timeout", "connection", "5xx", "429", "rate_limited")
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+RETRY_AFTER_MAX_WAIT = 5
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Unless METRICS_PORT is set per process, each shard process listens on 9108 plus its lowest shard id.
+METRICS_PORT = int(os.getenv("METRICS_PORT", str(9108 + min(BOT_SHARD_IDS, default=0))))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+API_HOST = urlsplit(API_BASE_URL).netloc
+# limit: pooled connections, rate/burst: token bucket in requests per second
+DEFAULT_HOST_SETTINGS = {"limit": 10, "timeout": 10, "keepalive": 30, "rate": 5, "burst": 10}
+HOST_SETTINGS = {
+    "users.roblox.com": {"limit": 10, "timeout": 10, "keepalive": 30, "rate": 10, "burst": 20},
+    "presence.roblox.com": {"limit": 10, "timeout": 10, "keepalive": 30, "rate": 5, "burst": 10},
+    "badges.roblox.com": {"limit": 5, "timeout": 10, "keepalive": 30, "rate": 5, "burst": 10},
+    "friends.roblox.com": {"limit": 5, "timeout": 10, "keepalive": 30, "rate": 5, "burst": 10},
+    "groups.roblox.com": {"limit": 10, "timeout": 10, "keepalive": 30, "rate": 10, "burst": 20},
+    "thumbnails.roblox.com": {"limit": 10, "timeout": 10, "keepalive": 30, "rate": 10, "burst": 20},
+    API_HOST: {
+        "limit": int(os.getenv("API_POOL_LIMIT", "20")),
+        "timeout": float(os.getenv("API_TIMEOUT", "10")),
+        "keepalive": 60,
+        "rate": float(os.getenv("API_RATE", "20")),
+        "burst": int(os.getenv("API_BURST", "40"))
+    }
+}
+
+class Metrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}
+        self.server = None
+
+    def inc(self, name, value=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def quantile(self, name, q, **labels):
+        histogram = self.histograms.get((name, tuple(sorted(labels.items()))))
+        if not histogram or not histogram[2]:
+            return None
+        target, seen = q * histogram[2], 0
+        for bound, count in zip(self.buckets + (float("inf"),), histogram[0]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def label_sets(self, name):
+        return [dict(labels) for n, labels in self.histograms if n == name]
+
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for name, func in sorted(self.gauges.items()):
+            try:
+                values = func()
+            except Exception as e:
+                logger.error(f"Error collecting gauge {name}: {str(e)}")
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            for labels, value in values.items():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+metrics = Metrics(LATENCY_BUCKETS)
+
+def timed(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            metrics.observe("helper_duration_seconds", time.perf_counter() - start, helper=func.__name__)
+    return wrapper
+
+class UpstreamError(Exception):
+    def __init__(self, message, status=None, data=None, timed_out=False, circuit_open=False):
+        super().__init__(message)
+        self.status = status
+        self.data = data
+        self.timed_out = timed_out
+        self.circuit_open = circuit_open
+
+def parse_retry_after(value, default=1.0):
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return default
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self):
+        # Tokens may go negative: each caller books the next free slot and waits for it.
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(-self.tokens / self.rate, self.paused_until - now, 0)
+
+    def cancel(self):
+        self.tokens += 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+class CircuitBreaker:
+    def __init__(self, host, threshold, cooldown):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half-open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Circuit for {self.host} closed")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.trial_in_flight = False
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.error(f"Circuit for {self.host} opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        self.trial_in_flight = False
+
+class HttpPool:
+    def __init__(self, host_settings, default_settings):
+        self.host_settings = host_settings
+        self.default_settings = default_settings
+        self.sessions = {}
+        self.buckets = {}
+        self.breakers = {}
+        # origin -> replacement base, used to point the bot at a stand-in API (see benchmark.py)
+        self.rewrites = {}
+
+    def settings_for(self, host):
+        return self.host_settings.get(host, self.default_settings)
+
+    def bucket_for(self, host):
+        if host not in self.buckets:
+            settings = self.settings_for(host)
+            self.buckets[host] = TokenBucket(settings["rate"], settings["burst"])
+        return self.buckets[host]
+
+    def breaker_for(self, host):
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(host, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN)
+        return self.breakers[host]
+
+    def session_for(self, host):
+        session = self.sessions.get(host)
+        if session is None or session.closed:
+            settings = self.settings_for(host)
+            connector = aiohttp.TCPConnector(limit=settings["limit"], keepalive_timeout=settings["keepalive"], ttl_dns_cache=300)
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=settings["timeout"]))
+            self.sessions[host] = session
+        return session
+
+    async def send(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        status, text, headers = await self.send_once(host, method, url, **kwargs)
+        if status == 429 and parse_retry_after(headers.get("Retry-After")) <= RETRY_AFTER_MAX_WAIT:
+            # The bucket is now paused for Retry-After, so this waits it out before trying once more.
+            status, text, headers = await self.send_once(host, method, url, **kwargs)
+        return status, text, headers
+
+    def target_url(self, url):
+        for origin, replacement in self.rewrites.items():
+            if url.startswith(origin):
+                return replacement + url[len(origin):]
+        return url
+
+    async def send_once(self, host, method, url, **kwargs):
+        settings = self.settings_for(host)
+        breaker = self.breaker_for(host)
+        bucket = self.bucket_for(host)
+        if not breaker.allow():
+            metrics.inc("upstream_errors_total", host=host, kind="circuit_open")
+            raise UpstreamError(f"{host} is failing, skipping {method} {url}", circuit_open=True)
+        healthy = None
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            wait = bucket.reserve()
+            if wait > settings["timeout"]:
+                bucket.cancel()
+                outcome = "rate_limited"
+                raise UpstreamError(f"Rate limited by {host} for another {wait:.1f}s", status=429)
+            if wait:
+                metrics.observe("upstream_rate_limit_wait_seconds", wait, host=host)
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            try:
+                async with self.session_for(host).request(method, self.target_url(url) if self.rewrites else url, **kwargs) as resp:
+                    status, text, headers = resp.status, await resp.text(), resp.headers
+            except asyncio.TimeoutError as e:
+                healthy = False
+                outcome = "timeout"
+                raise UpstreamError(f"Timed out after {settings['timeout']}s: {method} {url}", timed_out=True) from e
+            except aiohttp.ClientError as e:
+                healthy = False
+                outcome = "connection"
+                raise UpstreamError(f"{type(e).__name__}: {e}") from e
+            if status == 429:
+                bucket.pause(parse_retry_after(headers.get("Retry-After")))
+            healthy = status < 500
+            outcome = f"{status // 100}xx" if status != 429 else "429"
+            return status, text, headers
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("upstream_request_duration_seconds", elapsed, host=host, method=method)
+            metrics.inc("upstream_requests_total", host=host, outcome=outcome)
+            if outcome in UPSTREAM_FAILURE_OUTCOMES:
+                logger.warning(f"{method} {url} failed: {outcome}", extra={"upstream_host": host, "latency_ms": round(elapsed * 1000, 1)})
+            if healthy is None:
+                breaker.release()
+            elif healthy:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+
+    async def request(self, method, url, **kwargs):
+        status, text, _ = await self.send(method, url, **kwargs)
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise UpstreamError(f"{status} - invalid JSON from {method} {url}: {text[:200]}", status=status) from e
+        return status, data
+
+    async def get_json(self, url, **kwargs):
+        status, data = await self.request("GET", url, **kwargs)
+        if status >= 400:
+            raise UpstreamError(f"{status} error for GET {url}", status=status, data=data)
+        return data
+
+    async def post_json(self, url, payload, **kwargs):
+        status, data = await self.request("POST", url, json=payload, **kwargs)
+        if status >= 400:
+            raise UpstreamError(f"{status} error for POST {url}", status=status, data=data)
+        return data
+
+    async def conditional_get(self, url, etag=None, last_modified=None):
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        status, text, response_headers = await self.send("GET", url, headers=headers)
+        if status == 304:
+            return status, None, etag, last_modified
+        if status >= 400:
+            raise UpstreamError(f"{status} error for GET {url}", status=status)
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise UpstreamError(f"{status} - invalid JSON from GET {url}: {text[:200]}", status=status) from e
+        return status, data, response_headers.get("ETag"), response_headers.get("Last-Modified")
+
+    async def close(self):
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        for session in sessions:
+            await session.close()
+
+http_pool = HttpPool(HOST_SETTINGS, DEFAULT_HOST_SETTINGS)
+
+def open_database(path):
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+db = open_database(BOT_DB_PATH)
+
+class DbWriter:
+    # Every write goes through one thread in order, so waiting on another shard process's write lock never stalls the loop.
+    # Schema setup at import still uses `db` directly; nothing else is running yet.
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    def run(self, func, *args):
+        future = asyncio.wrap_future(self.executor.submit(self.write, func, *args))
+        future.add_done_callback(self.log_failure)
+        return future
+
+    def write(self, func, *args):
+        if self.conn is None:
+            self.conn = open_database(self.path)
+        try:
+            result = func(self.conn, *args)
+            self.conn.commit()
+            return result
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def execute(self, sql, params=()):
+        return self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    def executemany(self, sql, rows):
+        return self.run(lambda conn: conn.executemany(sql, rows).rowcount)
+
+    def log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Database write failed: {str(future.exception())}")
+
+db_writer = DbWriter(BOT_DB_PATH)
+
+def is_primary_process():
+    # Process-wide jobs (rank sync) run once, in the process that owns shard 0.
+    return not BOT_SHARD_IDS or 0 in BOT_SHARD_IDS
+
+def owns_guild(guild_id):
+    shard_ids = getattr(bot, "shard_ids", None)
+    if guild_id is None or shard_ids is None:
+        return True
+    return (guild_id >> 22) % bot.shard_count in shard_ids
+
+class SharedCache:
+    # JSON turns int dict keys into strings; these kinds are cached with int keys.
+    INT_KEYED_KINDS = ("ranks",)
+
+    def __init__(self, path, flush_interval, purge_every):
+        self.reader = open_database(path)
+        self.flush_interval = flush_interval
+        self.purge_every = purge_every
+        self.pending = {}
+        self.flush_task = None
+        self.flushes = 0
+        self.reader.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+        )
+        self.reader.commit()
+
+    def get(self, key):
+        row = self.reader.execute("SELECT value, fresh_until, stale_until FROM response_cache WHERE key = ?", (json.dumps(key),)).fetchone()
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        if key[0] in self.INT_KEYED_KINDS and isinstance(value, dict):
+            value = {int(k): v for k, v in value.items()}
+        return value, row[1], row[2]
+
+    def set(self, key, value, fresh_until, stale_until):
+        self.queue(key, (json.dumps(value), fresh_until, stale_until))
+
+    def delete(self, key):
+        self.queue(key, None)
 
+    def queue(self, key, row):
+        self.pending[json.dumps(key)] = row
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        batch, self.pending = self.pending, {}
+        self.flush_task = None
+        self.flushes += 1
+        try:
+            await db_writer.run(self.write, batch, self.flushes % self.purge_every == 0)
+        except sqlite3.Error:
+            pass  # Already logged by db_writer; the entries are still cached locally.
+
+    def write(self, conn, batch, purge):
+        conn.executemany(
+            "INSERT OR REPLACE INTO response_cache (key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+            [(key, *row) for key, row in batch.items() if row is not None]
+        )
+        conn.executemany("DELETE FROM response_cache WHERE key = ?", [(key,) for key, row in batch.items() if row is None])
+        if purge:
+            conn.execute("DELETE FROM response_cache WHERE stale_until < ?", (time.time(),))
+
+    def clear(self):
+        self.pending.clear()
+        return db_writer.execute("DELETE FROM response_cache")
+
+class ResponseCache:
+    def __init__(self, ttls, max_entries, shared=None):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.refreshing = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    async def fetch(self, key, factory, bypass=False):
+        entry = None if bypass else self.entries.get(key) or self.load_shared(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if now < stale_until:
+                self.entries.move_to_end(key)
+                self.stale_hits += 1
+                self.refresh(key, factory)
+                return value
+        self.misses += 1
+        if bypass:
+            # Never join an in-flight refresh: it may have started before the data we need changed.
+            return await asyncio.shield(asyncio.ensure_future(self.load(key, factory)))
+        try:
+            return await asyncio.shield(self.refresh(key, factory))
+        except UpstreamError:
+            # An expired value still beats an error while the upstream is unhealthy.
+            if key not in self.entries:
+                raise
+            self.fallbacks += 1
+            return self.entries[key][0]
+
+    def refresh(self, key, factory):
+        task = self.refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.load(key, factory))
+            self.refreshing[key] = task
+            task.add_done_callback(lambda t: self.finish_refresh(key, t))
+        return task
+
+    def finish_refresh(self, key, task):
+        if self.refreshing.get(key) is task:
+            del self.refreshing[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def load(self, key, factory):
+        value = await factory()
+        self.set(key, value)
+        return value
+
+    def load_shared(self, key):
+        if self.shared is None:
+            return None
+        entry = self.shared.get(key)
+        if entry is not None:
+            # The shared table holds wall-clock deadlines; local entries use the monotonic clock.
+            value, fresh_until, stale_until = entry
+            offset = time.monotonic() - time.time()
+            entry = (value, fresh_until + offset, stale_until + offset)
+            self.store(key, entry)
+        return entry
+
+    def set(self, key, value):
+        fresh_ttl, stale_ttl = self.ttls[key[0]]
+        now = time.monotonic()
+        self.store(key, (value, now + fresh_ttl, now + fresh_ttl + stale_ttl))
+        if self.shared is not None:
+            now = time.time()
+            self.shared.set(key, value, now + fresh_ttl, now + fresh_ttl + stale_ttl)
+
+    def store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, *key):
+        self.entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self.entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+response_cache = ResponseCache(CACHE_TTLS, CACHE_MAX_ENTRIES, SharedCache(BOT_DB_PATH, SHARED_CACHE_FLUSH_INTERVAL, SHARED_CACHE_PURGE_EVERY) if SHARED_CACHE else None)
+
+def deduplicated(func):
+    inflight = {}
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            inflight[key] = task
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        # Shielded so a caller hitting its deadline doesn't cancel the fetch for everyone else.
+        return await asyncio.shield(task)
+    return wrapper
+
+def lookup_result(name, task):
+    if task.cancelled():
+        return UNAVAILABLE
+    if task.exception() is not None:
+        logger.error(f"Lookup field {name} failed: {str(task.exception())}")
+        return UNAVAILABLE
+    return task.result()
+
+async def gather_with_deadline(jobs, timeout, on_update=None, first_update=0, update_interval=0):
+    # on_update gets the fields finished so far, first after first_update seconds and then at most once per update_interval.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(timeout, 0)
+    next_update = loop.time() + first_update
+    tasks = {asyncio.ensure_future(coro): name for name, coro in jobs.items()}
+    pending = set(tasks)
+    results = {}
+    updated = changed = False
+    while pending:
+        wake = deadline if on_update is None or (updated and not changed) else min(deadline, next_update)
+        done, pending = await asyncio.wait(pending, timeout=max(wake - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            results[tasks[task]] = lookup_result(tasks[task], task)
+        changed = changed or bool(done)
+        if not pending or loop.time() >= deadline:
+            break
+        if on_update is not None and loop.time() >= next_update and (changed or not updated):
+            await on_update(dict(results))
+            updated, changed = True, False
+            next_update = loop.time() + update_interval
+    for task in pending:
+        task.cancel()
+        results[tasks[task]] = UNAVAILABLE
+    return results
+
+@functools.lru_cache(maxsize=4096)
 def format_timestamp(ts):
+    if ts is None or ts in TIMESTAMP_SENTINELS:
+        return ts
     try:
-        if isinstance(ts, str) and ts.endswith("Z"):
+        if ts.endswith("Z"):
             ts = ts[:-1]
         dt = datetime.datetime.fromisoformat(ts)
         return dt.strftime("%b %d, %Y %I:%M %p")
-    except Exception as e:
-        logger.error(f"Error formatting timestamp: {str(e)}")
+    except (TypeError, ValueError, AttributeError) as e:
+        logger.error(f"Error formatting timestamp {ts!r}: {str(e)}")
         return ts
 
-def get_headshot(user_id):
+def headshot_fallback_url(user_id):
+    return f"https://www.roblox.com/headshot-thumbnail/image?userId={user_id}&width=420&height=420&format=png"
+
+@timed
+@deduplicated
+async def get_headshot(user_id):
     url = f"https://thumbnails.roblox.com/v1/users/avatar-headshot?userIds={user_id}&size=420x420&format=Png&isCircular=false"
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data["data"][0].get("imageUrl", f"https://www.roblox.com/headshot-thumbnail/image?userId={user_id}&width=420&height=420&format=png")
-    except requests.RequestException as e:
+        data = await response_cache.fetch(("headshot", user_id), lambda: http_pool.get_json(url))
+        return data["data"][0].get("imageUrl", headshot_fallback_url(user_id))
+    except UpstreamError as e:
         logger.error(f"Error fetching headshot for user {user_id}: {str(e)}")
-        return f"https://www.roblox.com/headshot-thumbnail/image?userId={user_id}&width=420&height=420&format=png"
+        return headshot_fallback_url(user_id)
 
-def get_group_rank(user_id, group_id):
-    url = f"{API_BASE_URL}/get_group_rank?userId={user_id}&groupId={group_id}"
+class GroupRankResolver:
+    # ResponseCache.refresh already merges concurrent loads per user, and the endpoint takes one user per request.
+    async def resolve(self, user_ids, group_ids, fresh=False):
+        group_ids = list(group_ids)
+        user_ids = list(set(user_ids))
+        lookups = await asyncio.gather(
+            *(response_cache.fetch(("ranks", user_id), functools.partial(self.fetch_memberships, user_id), bypass=fresh) for user_id in user_ids),
+            return_exceptions=True
+        )
+        results = {}
+        for user_id, memberships in zip(user_ids, lookups):
+            if isinstance(memberships, UpstreamError):
+                logger.error(f"Error fetching group ranks for user {user_id}: {str(memberships)}")
+                memberships = {}
+            elif isinstance(memberships, BaseException):
+                raise memberships
+            results[user_id] = {gid: memberships.get(gid, 'Not in group') for gid in group_ids}
+        return results
+
+    async def fetch_memberships(self, user_id):
+        # One call returns every group the user is in, so any number of group checks cost one request.
+        data = await http_pool.get_json(f"https://groups.roblox.com/v2/users/{user_id}/groups/roles")
+        try:
+            return {entry["group"]["id"]: entry["role"]["name"] for entry in data.get("data", [])}
+        except (KeyError, TypeError, AttributeError) as e:
+            raise UpstreamError(f"Malformed group roles response: {str(e)}") from e
+
+rank_resolver = GroupRankResolver()
+
+@timed
+async def get_group_roles(group_id):
+    url = f"https://groups.roblox.com/v1/groups/{group_id}/roles"
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('rank', 'Not in group')
-    except requests.RequestException as e:
-        logger.error(f"Error fetching group rank for user {user_id}, group {group_id}: {str(e)}")
-        return 'Not in group'
-
-def get_all_group_ranks(user_id, group_ids):
-    return {gid: get_group_rank(user_id, gid) for gid in group_ids}
-
-def get_roblox_profile(user_id):
+        data = await response_cache.fetch(("group_roles", group_id), lambda: http_pool.get_json(url))
+        # Only names and rank order: role ids for set_group_rank come from the XP API (resolve_role_id).
+        return {role["name"]: {"name": role["name"], "rank": role["rank"]} for role in data.get("roles", [])}
+    except (UpstreamError, KeyError, TypeError) as e:
+        logger.error(f"Error fetching roles for group {group_id}: {str(e)}")
+        return {}
+
+@timed
+async def get_group_rank(user_id, group_id):
+    ranks = await rank_resolver.resolve([user_id], [group_id])
+    return ranks[user_id][group_id]
+
+@timed
+async def get_all_group_ranks(user_id, group_ids, fresh=False):
+    ranks = await rank_resolver.resolve([user_id], group_ids, fresh=fresh)
+    return ranks[user_id]
+
+@timed
+@deduplicated
+async def get_roblox_profile(user_id, fresh=False):
     url = f"https://users.roblox.com/v1/users/{user_id}"
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        return resp.json()
-    except requests.RequestException as e:
+        return await response_cache.fetch(("profile", user_id), lambda: http_pool.get_json(url), bypass=fresh)
+    except UpstreamError as e:
         logger.error(f"Error fetching Roblox profile for user {user_id}: {str(e)}")
         return None
 
-def get_last_online(user_id):
-    url = "https://presence.roblox.com/v1/presence/last-online"
-    payload = {"userIds": [user_id]}
-    try:
-        resp = requests.post(url, json=payload, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        return data["data"][0].get("lastOnline", "N/A") if data.get("data") else "N/A"
-    except requests.RequestException as e:
-        logger.error(f"Error fetching last online for user {user_id}: {str(e)}")
-        return "N/A"
+class WindowedBatcher:
+    # Keys enqueued within `window` seconds are fetched together, batch_size at a time, as {key: future}.
+    def __init__(self, window, batch_size):
+        self.window = window
+        self.batch_size = batch_size
+        self.pending = {}
+        self.flush_task = None
 
-def get_presence_status(user_id):
-    url = "https://presence.roblox.com/v1/presence/users"
-    payload = {"userIds": [user_id]}
-    try:
-        resp = requests.post(url, json=payload, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        status_num = data["data"][0].get("userPresenceType", 0) if data.get("data") else 0
-        if status_num == 0:
-            lo = get_last_online(user_id)
-            return f"Offline (Last Online: {format_timestamp(lo)})" if lo != "N/A" else "Offline"
-        elif status_num == 1:
-            return "Online"
-        elif status_num == 2:
-            return "In Game"
-        elif status_num == 3:
-            return "In Studio"
-        return "Unknown"
-    except requests.RequestException as e:
-        logger.error(f"Error fetching presence status for user {user_id}: {str(e)}")
-        return "Unknown"
-
-def get_game_join_date(user_id, badge_id=GAME_BADGE_ID):
+    def enqueue(self, key):
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[key] = future
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+        return future
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        batch, self.pending = self.pending, {}
+        self.flush_task = None
+        keys = list(batch)
+        chunks = [keys[i:i + self.batch_size] for i in range(0, len(keys), self.batch_size)]
+        await asyncio.gather(*(self.run_chunk({key: batch[key] for key in chunk}) for chunk in chunks))
+
+    async def run_chunk(self, futures):
+        # Callers await these futures without a timeout, so every one must be resolved whatever happens.
+        error = None
+        try:
+            await self.fetch_chunk(futures)
+        except Exception as e:
+            logger.error(f"{type(self).__name__} batch of {len(futures)} failed: {str(e)}")
+            error = UpstreamError(f"{type(self).__name__} lookup failed: {str(e)}")
+        finally:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error or UpstreamError(f"{type(self).__name__} returned no result"))
+
+    async def fetch_chunk(self, futures):
+        raise NotImplementedError
+
+class PresenceBatcher(WindowedBatcher):
+    async def lookup(self, user_ids):
+        user_ids = list(set(user_ids))
+        lookups = await asyncio.gather(
+            *(response_cache.fetch(("presence", user_id), functools.partial(self.enqueue, user_id)) for user_id in user_ids),
+            return_exceptions=True
+        )
+        results = {}
+        for user_id, presence in zip(user_ids, lookups):
+            if isinstance(presence, UpstreamError):
+                logger.error(f"Error fetching presence for user {user_id}: {str(presence)}")
+            elif isinstance(presence, BaseException):
+                raise presence
+            else:
+                results[user_id] = presence
+        return results
+
+    async def fetch_chunk(self, futures):
+        try:
+            data = await http_pool.post_json("https://presence.roblox.com/v1/presence/users", {"userIds": list(futures)})
+            # Roblox documents "userPresences"; older responses and the XP API proxy use "data".
+            entries = data.get("userPresences", data.get("data", []))
+            presences = {
+                entry["userId"]: {"userPresenceType": entry.get("userPresenceType", 0), "lastOnline": entry.get("lastOnline")}
+                for entry in entries
+            }
+        except (UpstreamError, KeyError, TypeError, AttributeError) as e:
+            error = e if isinstance(e, UpstreamError) else UpstreamError(f"Malformed presence response: {str(e)}")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for user_id in futures:
+            presences.setdefault(user_id, {"userPresenceType": 0, "lastOnline": None})
+        # presence/users usually carries lastOnline already; only offline users without it need the second endpoint.
+        missing = [user_id for user_id, p in presences.items() if p["userPresenceType"] == 0 and not p["lastOnline"] and user_id in futures]
+        if missing:
+            try:
+                data = await http_pool.post_json("https://presence.roblox.com/v1/presence/last-online", {"userIds": missing})
+                for entry in data.get("lastOnlineTimestamps", data.get("data", [])):
+                    if entry.get("userId") in presences:
+                        presences[entry["userId"]]["lastOnline"] = entry.get("lastOnline")
+            except (UpstreamError, TypeError, AttributeError) as e:
+                logger.error(f"Error fetching last online for {len(missing)} users: {str(e)}")
+        for user_id, future in futures.items():
+            if not future.done():
+                future.set_result(presences[user_id])
+
+presence_batcher = PresenceBatcher(PRESENCE_BATCH_WINDOW, PRESENCE_BATCH_SIZE)
+
+def format_presence(presence):
+    status_num = presence.get("userPresenceType", 0)
+    if status_num == 0:
+        lo = presence.get("lastOnline")
+        return f"Offline (Last Online: {format_timestamp(lo)})" if lo else "Offline"
+    elif status_num == 1:
+        return "Online"
+    elif status_num == 2:
+        return "In Game"
+    elif status_num == 3:
+        return "In Studio"
+    return "Unknown"
+
+@timed
+async def get_presence_statuses(user_ids):
+    presences = await presence_batcher.lookup(user_ids)
+    return {user_id: format_presence(presences[user_id]) if user_id in presences else "Unknown" for user_id in user_ids}
+
+async def get_presence_status(user_id):
+    statuses = await get_presence_statuses([user_id])
+    return statuses[user_id]
+
+@timed
+@deduplicated
+async def get_game_join_date(user_id, badge_id=GAME_BADGE_ID):
     url = f"https://badges.roblox.com/v1/users/{user_id}/badges/awarded-dates?badgeIds={badge_id}"
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await response_cache.fetch(("badge", user_id, badge_id), lambda: http_pool.get_json(url))
         return data["data"][0].get("awardedDate", "N/A") if data.get("data") else "Not Awarded"
-    except requests.RequestException as e:
+    except UpstreamError as e:
         logger.error(f"Error fetching game join date for user {user_id}: {str(e)}")
         return "Error"
 
-def get_friends_count(user_id):
+@timed
+@deduplicated
+async def get_friends_count(user_id):
     url = f"https://friends.roblox.com/v1/users/{user_id}/friends/count"
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        return resp.json().get("count", "N/A")
-    except requests.RequestException as e:
+        data = await response_cache.fetch(("friends", user_id), lambda: http_pool.get_json(url))
+        return data.get("count", "N/A")
+    except UpstreamError as e:
         logger.error(f"Error fetching friends count for user {user_id}: {str(e)}")
         return "N/A"
 
-def get_roblox_user_id(username):
-    url = "https://users.roblox.com/v1/usernames/users"
-    payload = {"usernames": [username], "excludeBannedUsers": False}
-    try:
-        resp = requests.post(url, json=payload, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        return data["data"][0].get("id") if data.get("data") else None
-    except requests.RequestException as e:
-        logger.error(f"Error fetching user ID for username {username}: {str(e)}")
-        return None
+class UsernameResolver(WindowedBatcher):
+    def __init__(self, conn, window, batch_size, ttl, negative_ttl):
+        super().__init__(window, batch_size)
+        self.conn = conn
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Usernames are stored lowercased; a NULL user_id records a name Roblox didn't know.
+        conn.execute("CREATE TABLE IF NOT EXISTS username_ids (username TEXT PRIMARY KEY, user_id INTEGER, resolved_at REAL NOT NULL)")
+        conn.commit()
+
+    def lookup_stored(self, names):
+        now = time.time()
+        found = {}
+        names = list(names)
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT username, user_id, resolved_at FROM username_ids WHERE username IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for username, user_id, resolved_at in rows:
+                if now - resolved_at < (self.ttl if user_id is not None else self.negative_ttl):
+                    found[username] = user_id
+        return found
+
+    def remember(self, resolved):
+        now = time.time()
+        return db_writer.executemany(
+            "INSERT OR REPLACE INTO username_ids (username, user_id, resolved_at) VALUES (?, ?, ?)",
+            [(name.lower(), user_id, now) for name, user_id in resolved.items()]
+        )
+
+    async def resolve_many(self, usernames):
+        names = {name.strip().lower() for name in usernames if name.strip()}
+        results = self.lookup_stored(names)
+        futures = {name: self.enqueue(name) for name in names if name not in results}
+        lookups = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()), return_exceptions=True)
+        for name, user_id in zip(futures, lookups):
+            if isinstance(user_id, UpstreamError):
+                logger.error(f"Error fetching user ID for username {name}: {str(user_id)}")
+            elif isinstance(user_id, BaseException):
+                raise user_id
+            else:
+                results[name] = user_id
+        return results
+
+    async def fetch_chunk(self, futures):
+        payload = {"usernames": list(futures), "excludeBannedUsers": False}
+        try:
+            data = await http_pool.post_json("https://users.roblox.com/v1/usernames/users", payload)
+            resolved = {name: None for name in futures}
+            for entry in data.get("data", []):
+                resolved[entry["requestedUsername"].lower()] = entry["id"]
+        except (UpstreamError, KeyError, TypeError, AttributeError) as e:
+            error = e if isinstance(e, UpstreamError) else UpstreamError(f"Malformed username response: {str(e)}")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for name, future in futures.items():
+            if not future.done():
+                future.set_result(resolved.get(name))
+        self.remember(resolved)
+
+username_resolver = UsernameResolver(db, USERNAME_BATCH_WINDOW, USERNAME_BATCH_SIZE, USERNAME_TTL, USERNAME_NEGATIVE_TTL)
+
+@timed
+async def get_roblox_user_id(username):
+    results = await username_resolver.resolve_many([username])
+    return results.get(username.strip().lower())
+
+@timed
+@deduplicated
+async def get_user_data(username):
+    return await http_pool.get_json(f"{API_BASE_URL}/get_user_data?username={username}")
+
+@timed
+async def set_xp(user_id, xp):
+    return await http_pool.post_json(f"{API_BASE_URL}/set_xp", {"userId": user_id, "xp": xp})
+
+def data_embed(username, user_id, result, fields):
+    # Fields missing from `fields` are still loading.
+    profile = fields.get("profile", DATA_LOADING)
+    if profile in (UNAVAILABLE, DATA_LOADING):
+        display_name, account_created = username, profile
+    else:
+        display_name = profile.get("displayName", username) if profile else username
+        account_created = format_timestamp(profile.get("created")) if profile else "N/A"
+    game_join_date = fields.get("game_join_date", DATA_LOADING)
+    game_join_date = "N/A" if game_join_date in ("Not Awarded", "Error") else format_timestamp(game_join_date)
+    other_ranks = fields.get("other_ranks", DATA_LOADING)
+    if isinstance(other_ranks, dict):
+        kingdoms_text = "\n".join([f"**{OTHER_KINGDOM_IDS[gid]}:** {rank}" for gid, rank in other_ranks.items()])
+    else:
+        kingdoms_text = other_ranks
+    headshot = fields.get("headshot", UNAVAILABLE)
+    if headshot in (UNAVAILABLE, DATA_LOADING):
+        headshot = headshot_fallback_url(user_id)
+    offense_data = result.get("offenseData", {})
+    offense_text = "\n".join([f"Rule {k}: {v} strikes" for k, v in offense_data.items()]) if offense_data else "None"
+    embed = discord.Embed(title=f"{username}'s Roblox Data", color=discord.Color.blue())
+    embed.set_thumbnail(url=headshot)
+    embed.add_field(name="Display Name", value=display_name, inline=True)
+    embed.add_field(name="XP", value=result.get("xp", "Unknown"), inline=True)
+    embed.add_field(name="Last Updated", value=format_timestamp(result.get("last_updated", "Unknown")), inline=True)
+    embed.add_field(name="Account Created", value=account_created, inline=True)
+    embed.add_field(name="Presence", value=fields.get("presence", DATA_LOADING), inline=True)
+    embed.add_field(name="Game Join Date", value=game_join_date, inline=True)
+    embed.add_field(name="Friends", value=fields.get("friends", DATA_LOADING), inline=True)
+    embed.add_field(name="Main Group Rank", value=fields.get("main_rank", DATA_LOADING), inline=True)
+    embed.add_field(name="Offense Data", value=offense_text, inline=False)
+    embed.add_field(name="Other Kingdom Ranks", value=kingdoms_text, inline=False)
+    embed.add_field(name="Profile", value=f"[View Roblox Profile](https://www.roblox.com/users/{user_id}/profile)", inline=False)
+    return embed
 
 @bot.command()
-async def data(ctx, platform: str, username: str):
+async def data(ctx, platform: str, username: typing.Union[discord.User, str]):
     if platform.lower() != "roblox":
         await ctx.send("Unsupported platform. Please use 'roblox'.")
         return
-    api_url = f"{API_BASE_URL}/get_user_data?username={username}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DATA_LOOKUP_DEADLINE
+    # The converter also matches cached Discord names, but a bare name is always a Roblox username here.
+    if isinstance(username, discord.User) and ctx.current_argument.strip("<@!>") != str(username.id):
+        username = ctx.current_argument
+    if isinstance(username, discord.User):
+        link = account_links.get_by_discord(username.id)
+        if link is None:
+            await ctx.send("That member hasn't linked a Roblox account yet.")
+            return
+        # The XP API is keyed by username, so look up the account's current name in case it was renamed.
+        profile = await get_roblox_profile(link["roblox_id"])
+        username = profile.get("name") if profile else link["username"]
+        if not username:
+            await ctx.send("Failed to fetch user data. Please try again later.")
+            return
     try:
-        response = requests.get(api_url, timeout=10)
-        response.raise_for_status()
-        result = response.json()
+        result = await asyncio.wait_for(get_user_data(username), max(deadline - loop.time(), 0))
         if "error" in result:
             await ctx.send(f"Error: {result['error']}")
             return
@@ -156,39 +1165,43 @@ async def data(ctx, platform: str, username: str):
         if not user_id:
             await ctx.send("User data does not include a userId.")
             return
-        xp = result.get("xp", "Unknown")
-        offense_data = result.get("offenseData", {})
-        last_updated = result.get("last_updated", "Unknown")
-        profile = get_roblox_profile(user_id)
-        display_name = profile.get("displayName", username) if profile else username
-        account_created = format_timestamp(profile.get("created")) if profile else "N/A"
-        presence_status = get_presence_status(user_id)
-        game_join_date = format_timestamp(get_game_join_date(user_id)) if get_game_join_date(user_id) not in ["Not Awarded", "Error", "N/A"] else "N/A"
-        friends_count = get_friends_count(user_id)
-        main_group_rank = get_group_rank(user_id, MAIN_GROUP_ID)
-        other_ranks = get_all_group_ranks(user_id, OTHER_KINGDOM_IDS.keys())
-        kingdoms_text = "\n".join([f"**{OTHER_KINGDOM_IDS[gid]}:** {rank}" for gid, rank in other_ranks.items()])
-        offense_text = "\n".join([f"Rule {k}: {v} strikes" for k, v in offense_data.items()]) if offense_data else "None"
-        embed = discord.Embed(title=f"{username}'s Roblox Data", color=discord.Color.blue())
-        embed.set_thumbnail(url=get_headshot(user_id))
-        embed.add_field(name="Display Name", value=display_name, inline=True)
-        embed.add_field(name="XP", value=xp, inline=True)
-        embed.add_field(name="Last Updated", value=format_timestamp(last_updated) if last_updated != "Unknown" else last_updated, inline=True)
-        embed.add_field(name="Account Created", value=account_created, inline=True)
-        embed.add_field(name="Presence", value=presence_status, inline=True)
-        embed.add_field(name="Game Join Date", value=game_join_date, inline=True)
-        embed.add_field(name="Friends", value=friends_count, inline=True)
-        embed.add_field(name="Main Group Rank", value=main_group_rank, inline=True)
-        embed.add_field(name="Offense Data", value=offense_text, inline=False)
-        embed.add_field(name="Other Kingdom Ranks", value=kingdoms_text, inline=False)
-        embed.add_field(name="Profile", value=f"[View Roblox Profile](https://www.roblox.com/users/{user_id}/profile)", inline=False)
-        await ctx.send(embed=embed)
-    except requests.RequestException as e:
+        username_resolver.remember({username: user_id})
+        message = None
+
+        # Cached fields usually land before the first paint; slow ones are edited in as they arrive.
+        async def show_progress(fields):
+            nonlocal message
+            try:
+                if message is None:
+                    message = await ctx.send(embed=data_embed(username, user_id, result, fields))
+                else:
+                    await message.edit(embed=data_embed(username, user_id, result, fields))
+            except discord.HTTPException as e:
+                logger.error(f"Error updating data embed for {username}: {str(e)}")
+
+        fields = await gather_with_deadline({
+            "profile": get_roblox_profile(user_id),
+            "presence": get_presence_status(user_id),
+            "game_join_date": get_game_join_date(user_id),
+            "friends": get_friends_count(user_id),
+            "main_rank": get_group_rank(user_id, MAIN_GROUP_ID),
+            "other_ranks": get_all_group_ranks(user_id, OTHER_KINGDOM_IDS.keys()),
+            "headshot": get_headshot(user_id)
+        }, deadline - loop.time(), on_update=show_progress, first_update=DATA_FIRST_PAINT, update_interval=DATA_EDIT_INTERVAL)
+        embed = data_embed(username, user_id, result, fields)
+        if message is None:
+            await ctx.send(embed=embed)
+        else:
+            await message.edit(embed=embed)
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out fetching data for {username}")
+        await ctx.send("Timed out fetching user data. Please try again later.")
+    except UpstreamError as e:
         logger.error(f"Error fetching data for {username}: {str(e)}")
         await ctx.send("Failed to fetch user data. Please try again later.")
 
 @bot.command()
-@commands.has_any_role("Proxy", "Head Proxy", "Vortex", "Noob", "Alaska's Father", "Alaska", "The Queen", "Bacon", "Role Updater")
+@commands.has_any_role(*XP_EDITOR_ROLES)
 async def setxp(ctx, platform: str, username: str, new_xp: int):
     if platform.lower() != "roblox":
         await ctx.send("Unsupported platform. Please use 'roblox'.")
@@ -197,190 +1210,721 @@ async def setxp(ctx, platform: str, username: str, new_xp: int):
         await ctx.send("XP must be a non-negative integer.")
         return
     try:
-        user_id = get_roblox_user_id(username)
+        user_id = await get_roblox_user_id(username)
         if not user_id:
             await ctx.send(f"Could not find Roblox user {username}.")
             return
-        url = f"{API_BASE_URL}/set_xp"
-        payload = {"userId": user_id, "xp": new_xp}
-        resp = requests.post(url, json=payload, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
+        result = await set_xp(user_id, new_xp)
         if "error" in result:
             await ctx.send(f"Error: {result['error']}")
             return
         await ctx.send(f"Successfully set {username}'s XP to {result.get('newXp', new_xp)}. Changes will reflect in-game within 5 minutes.")
-    except requests.RequestException as e:
+    except UpstreamError as e:
         logger.error(f"Error setting XP for {username}: {str(e)}")
         await ctx.send("Failed to update XP. Please try again later.")
 
+def parse_xp_rows(text):
+    rows, errors = [], []
+    for line_no, fields in enumerate(csv.reader(io.StringIO(text)), 1):
+        fields = [f.strip() for f in fields if f.strip()]
+        if len(fields) == 1:
+            fields = fields[0].split()
+        if not fields:
+            continue
+        if len(fields) != 2:
+            errors.append((line_no, " ".join(fields), False, "Expected 'username, xp' or 'username, +delta'"))
+            continue
+        username, value = fields
+        if username.lower() == "username" and not rows and not errors:
+            continue
+        try:
+            amount = int(value)
+        except ValueError:
+            errors.append((line_no, username, False, f"'{value}' is not a whole number"))
+            continue
+        rows.append({"line": line_no, "username": username, "amount": amount, "delta": value[0] in "+-"})
+    return rows, errors
+
+def merge_xp_rows(rows):
+    # One write per player: deltas add up, and an absolute value replaces the rows before it.
+    merged = {}
+    for row in rows:
+        key = row["username"].lower()
+        current = merged.get(key)
+        lines = (current["lines"] if current else []) + [(row["line"], row["username"])]
+        if current is None or not row["delta"]:
+            merged[key] = dict(row, lines=lines)
+        else:
+            current["amount"] += row["amount"]
+            current["lines"] = lines
+    return list(merged.values())
+
+async def apply_xp_row(row, user_ids):
+    name = row["username"].lower()
+    if name not in user_ids:
+        return row["line"], row["username"], False, "Username lookup failed"
+    user_id = user_ids[name]
+    if not user_id:
+        return row["line"], row["username"], False, "Roblox user not found"
+    try:
+        xp = row["amount"]
+        if row["delta"]:
+            current = await get_user_data(row["username"])
+            if "error" in current:
+                return row["line"], row["username"], False, current["error"]
+            xp = int(current.get("xp", 0)) + row["amount"]
+        if xp < 0:
+            return row["line"], row["username"], False, f"XP would be negative ({xp})"
+        result = await set_xp(user_id, xp)
+        if "error" in result:
+            return row["line"], row["username"], False, result["error"]
+        return row["line"], row["username"], True, f"XP set to {result.get('newXp', xp)}"
+    except UpstreamError as e:
+        logger.error(f"Error setting XP for {row['username']}: {str(e)}")
+        return row["line"], row["username"], False, "XP API request failed"
+    except (TypeError, ValueError):
+        return row["line"], row["username"], False, "Current XP is not a number"
+
+@bot.command()
+@commands.has_any_role(*XP_EDITOR_ROLES)
+async def bulksetxp(ctx, platform: str, *, rows: str = ""):
+    if platform.lower() != "roblox":
+        await ctx.send("Unsupported platform. Please use 'roblox'.")
+        return
+    text = rows
+    for attachment in ctx.message.attachments:
+        try:
+            text += "\n" + (await attachment.read()).decode("utf-8-sig")
+        except (discord.HTTPException, UnicodeDecodeError) as e:
+            logger.error(f"Error reading bulk XP attachment {attachment.filename}: {str(e)}")
+            await ctx.send(f"Could not read attachment {attachment.filename}.")
+            return
+    parsed, results = parse_xp_rows(text)
+    if not parsed and not results:
+        await ctx.send("Usage: -bulksetxp roblox followed by one 'username, xp' or 'username, +delta' per line, or a CSV attachment.")
+        return
+    if len(parsed) > BULK_XP_MAX_ROWS:
+        await ctx.send(f"Too many rows ({len(parsed)}). The limit is {BULK_XP_MAX_ROWS} per command.")
+        return
+    progress = await ctx.send(f"Updating XP for {len(parsed)} players... 0/{len(parsed)} done.")
+    user_ids = await username_resolver.resolve_many(row["username"] for row in parsed)
+    semaphore = asyncio.Semaphore(BULK_XP_CONCURRENCY)
+    done = 0
+
+    async def apply(row):
+        nonlocal done
+        async with semaphore:
+            _, _, ok, message = await apply_xp_row(row, user_ids)
+        done += len(row["lines"])
+        if len(row["lines"]) > 1:
+            message = f"{message} (combined {len(row['lines'])} rows)"
+        return [(line, username, ok, message) for line, username in row["lines"]]
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+            try:
+                await progress.edit(content=f"Updating XP for {len(parsed)} players... {done}/{len(parsed)} done.")
+            except discord.HTTPException as e:
+                logger.error(f"Error editing bulk XP progress: {str(e)}")
+
+    reporter = asyncio.create_task(report_progress())
+    try:
+        for outcomes in await asyncio.gather(*(apply(row) for row in merge_xp_rows(parsed))):
+            results.extend(outcomes)
+    finally:
+        reporter.cancel()
+    results.sort(key=lambda r: r[0])
+    succeeded = sum(1 for r in results if r[2])
+    summary = f"Bulk XP update finished: {succeeded} succeeded, {len(results) - succeeded} failed. Changes will reflect in-game within 5 minutes."
+    details = "\n".join(f"Line {line}: {username} - {'OK' if ok else 'FAILED'}: {message}" for line, username, ok, message in results)
+    if len(summary) + len(details) + 10 <= 2000:
+        await progress.edit(content=f"{summary}\n```\n{details}\n```")
+        return
+    await progress.edit(content=summary)
+    report = io.StringIO()
+    writer = csv.writer(report)
+    writer.writerow(["line", "username", "status", "message"])
+    for line, username, ok, message in results:
+        writer.writerow([line, username, "ok" if ok else "failed", message])
+    await ctx.send(file=discord.File(io.BytesIO(report.getvalue().encode()), filename="bulksetxp_results.csv"))
+
+class LeaderboardSnapshot:
+    def __init__(self, players):
+        self.players = sorted(players, key=lambda p: p.get("xp", 0), reverse=True)
+        self.index = {p["username"].lower(): i for i, p in enumerate(self.players) if p.get("username")}
+        # Negated so bisect can work on an ascending list.
+        self.sorted_xp = [-p.get("xp", 0) for p in self.players]
+        self.fetched_at = datetime.datetime.utcnow()
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.players) // LEADERBOARD_PAGE_SIZE))
+
+    def page(self, page):
+        start = (page - 1) * LEADERBOARD_PAGE_SIZE
+        return list(enumerate(self.players[start:start + LEADERBOARD_PAGE_SIZE], start + 1))
+
+    def rank_of(self, username):
+        i = self.index.get(username.lower())
+        return (i + 1, self.players[i]) if i is not None else (None, None)
+
+    def position_for_xp(self, xp):
+        return bisect.bisect_left(self.sorted_xp, -xp) + 1
+
+class LeaderboardCache:
+    def __init__(self, url):
+        self.url = url
+        self.snapshot = None
+        self.etag = None
+        self.last_modified = None
+        self.lock = asyncio.Lock()
+
+    async def refresh(self):
+        async with self.lock:
+            # Validators only make sense with a snapshot to fall back on when the answer is 304.
+            if self.snapshot is None:
+                self.etag = self.last_modified = None
+            status, data, etag, last_modified = await http_pool.conditional_get(self.url, self.etag, self.last_modified)
+            if status == 304:
+                if self.snapshot is None:
+                    raise UpstreamError(f"304 without a cached leaderboard for GET {self.url}", status=status)
+                self.snapshot.fetched_at = datetime.datetime.utcnow()
+                return self.snapshot
+            self.snapshot = LeaderboardSnapshot(data.get('leaderboard', []))
+            self.etag, self.last_modified = etag, last_modified
+            return self.snapshot
+
+    async def get(self):
+        if self.snapshot is None:
+            return await self.refresh()
+        return self.snapshot
+
+leaderboard_cache = LeaderboardCache(f"{API_BASE_URL}/leaderboard")
+
+def leaderboard_embed(snapshot, page):
+    embed = discord.Embed(title="Roblox XP Leaderboard", description="Top players by XP", color=discord.Color.gold())
+    for rank, player in snapshot.page(page):
+        embed.add_field(name=f"#{rank} - {player['username']}", value=f"XP: {player['xp']}", inline=False)
+    embed.set_footer(text=f"Page {page}/{snapshot.page_count} - updated {snapshot.fetched_at.strftime('%H:%M')} UTC")
+    return embed
+
+class LeaderboardView(discord.ui.View):
+    def __init__(self, snapshot, page):
+        super().__init__(timeout=300)
+        self.snapshot = snapshot
+        self.page = page
+        self.message = None
+        self.update_buttons()
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException as e:
+            logger.error(f"Error disabling leaderboard buttons: {str(e)}")
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page <= 1
+        self.next_page.disabled = self.page >= self.snapshot.page_count
+
+    async def show(self, interaction):
+        self.update_buttons()
+        await interaction.response.edit_message(embed=leaderboard_embed(self.snapshot, self.page), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.grey)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(1, self.page - 1)
+        await self.show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.snapshot.page_count, self.page + 1)
+        await self.show(interaction)
+
 @bot.command()
-async def leaderboard(ctx, platform: str):
+async def leaderboard(ctx, platform: str, page: int = 1):
     if platform.lower() != "roblox":
         await ctx.send("Unsupported platform. Please use 'roblox'.")
         return
     try:
-        response = requests.get(f"{API_BASE_URL}/leaderboard", timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        top_players = data.get('leaderboard', [])
-        if not top_players:
+        snapshot = await leaderboard_cache.get()
+        if not snapshot.players:
             await ctx.send("No leaderboard data available.")
             return
-        embed = discord.Embed(title="Roblox XP Leaderboard", description="Top players by XP", color=discord.Color.gold())
-        for i, player in enumerate(top_players, 1):
-            embed.add_field(name=f"#{i} - {player['username']}", value=f"XP: {player['xp']}", inline=False)
-        await ctx.send(embed=embed)
-    except requests.RequestException as e:
+        page = min(max(page, 1), snapshot.page_count)
+        view = LeaderboardView(snapshot, page)
+        view.message = await ctx.send(embed=leaderboard_embed(snapshot, page), view=view)
+    except UpstreamError as e:
         logger.error(f"Error fetching leaderboard: {str(e)}")
         await ctx.send("Failed to fetch leaderboard. Please try again later.")
 
-pending_verifications = {}
+@bot.command()
+async def rank(ctx, platform: str, username: str):
+    if platform.lower() != "roblox":
+        await ctx.send("Unsupported platform. Please use 'roblox'.")
+        return
+    try:
+        snapshot = await leaderboard_cache.get()
+        position, player = snapshot.rank_of(username)
+        if player:
+            await ctx.send(f"{player['username']} is #{position} of {len(snapshot.players)} with {player['xp']} XP.")
+            return
+        result = await get_user_data(username)
+        if "error" in result or not isinstance(result.get("xp"), (int, float)):
+            await ctx.send(f"{username} is not on the leaderboard.")
+            return
+        await ctx.send(f"{username} is not on the leaderboard. With {result['xp']} XP they would place #{snapshot.position_for_xp(result['xp'])}.")
+    except UpstreamError as e:
+        logger.error(f"Error fetching rank for {username}: {str(e)}")
+        await ctx.send("Failed to fetch leaderboard. Please try again later.")
 
-async def handle_ticket(channel, interaction):
-    max_retries = 3
+class VerificationStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.expiry_heap = []
+        self.evictions = 0
+        self.timer = None
+        self.timer_at = None
 
-    def check(m):
-        return m.author == interaction.user and m.channel == channel
+    def __len__(self):
+        return len(self.entries)
 
-    await channel.send(f"{interaction.user.mention}, please provide your Roblox username.")
-    retries = max_retries
-    username = None
-    user_id = None
-    while retries > 0:
+    def add(self, username, discord_id, code):
+        key = username.lower()
+        expires_at = time.monotonic() + self.ttl
+        self.entries[key] = {"discord_id": discord_id, "code": code, "expires_at": expires_at}
+        heapq.heappush(self.expiry_heap, (expires_at, key))
+        self.schedule()
+
+    def remove(self, username):
+        self.entries.pop(username.lower(), None)
+        # Removed entries stay in the heap until popped; rebuild once they dominate it.
+        if len(self.expiry_heap) > 2 * len(self.entries) + 64:
+            self.expiry_heap = [(entry["expires_at"], key) for key, entry in self.entries.items()]
+            heapq.heapify(self.expiry_heap)
+
+    def expire(self):
+        self.timer = self.timer_at = None
+        now = time.monotonic()
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self.expiry_heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires_at"] == expires_at:
+                del self.entries[key]
+                self.evictions += 1
+        self.schedule()
+
+    def schedule(self):
+        if not self.expiry_heap:
+            return
+        next_at = self.expiry_heap[0][0]
+        if self.timer is not None:
+            if self.timer_at <= next_at:
+                return
+            self.timer.cancel()
+        self.timer_at = next_at
+        self.timer = asyncio.get_running_loop().call_later(max(next_at - time.monotonic(), 0), self.expire)
+
+    def stats(self):
+        return {"size": len(self.entries), "evictions": self.evictions}
+
+pending_verifications = VerificationStore(VERIFICATION_TTL)
+
+TICKET_TIMEOUT_MESSAGES = {
+    "username": "Timed out waiting for username.",
+    "confirm": "Timed out waiting for confirmation.",
+    "choice": "Timed out waiting for choice."
+}
+
+class TicketStore:
+    def __init__(self, conn):
+        self.conn = conn
+        conn.execute("CREATE TABLE IF NOT EXISTS tickets (channel_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        conn.commit()
+        self.tickets = {}
+        self.locks = {}
+        self.timers = {}
+
+    def get(self, channel_id):
+        return self.tickets.get(channel_id)
+
+    def lock(self, channel_id):
+        return self.locks.setdefault(channel_id, asyncio.Lock())
+
+    def save(self, ticket):
+        ticket["expires_at"] = time.time() + TICKET_STEP_TIMEOUT
+        self.tickets[ticket["channel_id"]] = ticket
+        db_writer.execute("INSERT OR REPLACE INTO tickets (channel_id, data) VALUES (?, ?)", (ticket["channel_id"], json.dumps(ticket)))
+        self.schedule(ticket)
+
+    def delete(self, channel_id):
+        ticket = self.tickets.pop(channel_id, None)
+        if ticket and ticket.get("username"):
+            pending_verifications.remove(ticket["username"])
+        self.locks.pop(channel_id, None)
+        timer = self.timers.pop(channel_id, None)
+        if timer:
+            timer.cancel()
+        db_writer.execute("DELETE FROM tickets WHERE channel_id = ?", (channel_id,))
+
+    def schedule(self, ticket):
+        timer = self.timers.pop(ticket["channel_id"], None)
+        if timer:
+            timer.cancel()
+        delay = max(ticket["expires_at"] - time.time(), 0)
+        self.timers[ticket["channel_id"]] = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.create_task(expire_ticket(ticket["channel_id"]))
+        )
+
+    def resume_all(self):
+        # Each shard process only drives the tickets in its own guilds.
+        for channel_id, data in self.conn.execute("SELECT channel_id, data FROM tickets").fetchall():
+            ticket = json.loads(data)
+            if owns_guild(ticket.get("guild_id")):
+                self.tickets[channel_id] = ticket
+        for ticket in self.tickets.values():
+            if ticket["state"] == "confirm":
+                pending_verifications.add(ticket["username"], ticket["discord_id"], ticket["code"])
+            self.schedule(ticket)
+        if self.tickets:
+            logger.info(f"Resumed {len(self.tickets)} open tickets")
+
+ticket_store = TicketStore(db)
+
+async def get_ticket_channel(channel_id):
+    channel = bot.get_channel(channel_id)
+    if channel is None:
         try:
-            msg = await bot.wait_for("message", check=check, timeout=300)
-            username = msg.content.strip()
-            user_id = get_roblox_user_id(username)
-            if not user_id:
-                retries -= 1
-                await channel.send(f"Invalid username. {retries} retries left.")
-                if retries == 0:
-                    await channel.send("Max retries reached. Please start a new ticket.")
-                    return None, None
-                continue
-            break
-        except asyncio.TimeoutError:
-            await channel.send("Timed out waiting for username.")
-            return None, None
+            channel = await bot.fetch_channel(channel_id)
+        except discord.NotFound:
+            return None
+    return channel
 
-    verification_code = str(uuid.uuid4()).split("-")[0]
-    pending_verifications[username.lower()] = {
+async def expire_ticket(channel_id):
+    async with ticket_store.lock(channel_id):
+        ticket = ticket_store.get(channel_id)
+        if ticket is None:
+            return
+        if ticket["expires_at"] > time.time():
+            # call_later runs on the monotonic clock and can fire slightly before the wall-clock deadline.
+            ticket_store.schedule(ticket)
+            return
+        ticket_store.delete(channel_id)
+        metrics.inc("ticket_timeouts_total", state=ticket["state"])
+        try:
+            channel = await get_ticket_channel(channel_id)
+            if channel:
+                await channel.send(TICKET_TIMEOUT_MESSAGES[ticket["state"]])
+        except discord.HTTPException as e:
+            logger.error(f"Error sending ticket timeout for channel {channel_id}: {str(e)}")
+
+async def end_ticket(channel, ticket, message=None):
+    ticket_store.delete(ticket["channel_id"])
+    if message:
+        await channel.send(message)
+
+async def retry_ticket_step(channel, ticket, message):
+    ticket["retries"] -= 1
+    await channel.send(f"{message} {ticket['retries']} retries left.")
+    if ticket["retries"] <= 0:
+        await end_ticket(channel, ticket, "Max retries reached. Please start a new ticket.")
+    else:
+        ticket_store.save(ticket)
+
+async def handle_ticket(channel, interaction):
+    ticket = {
+        "channel_id": channel.id,
+        "guild_id": interaction.guild_id,
         "discord_id": interaction.user.id,
-        "code": verification_code,
-        "timestamp": datetime.datetime.utcnow().isoformat()
+        "state": "username",
+        "retries": TICKET_MAX_RETRIES
     }
-    await channel.send(f"Add this code to your Roblox bio: `{verification_code}`\nReply with 'confirm' when done.")
+    link = account_links.get_by_discord(interaction.user.id)
+    if link:
+        ticket["roblox_id"] = link["roblox_id"]
+        await channel.send(
+            f"{interaction.user.mention}, you're already verified as **{link['username'] or link['roblox_id']}**. "
+            "If that's not your account, ask staff to unlink it."
+        )
+        await show_ticket_ranks(channel, ticket)
+        return
+    ticket_store.save(ticket)
+    await channel.send(f"{interaction.user.mention}, please provide your Roblox username.")
 
-    retries = max_retries
-    while retries > 0:
-        try:
-            msg = await bot.wait_for("message", check=check, timeout=300)
-            if msg.content.lower() != "confirm":
-                retries -= 1
-                await channel.send(f"Please reply with 'confirm'. {retries} retries left.")
-                if retries == 0:
-                    await channel.send("Max retries reached. Please start a new ticket.")
-                    return None, None
-                continue
-            profile = get_roblox_profile(user_id)
-            if not profile or verification_code not in profile.get("description", ""):
-                retries -= 1
-                await channel.send(f"Code not found in bio. {retries} retries left.")
-                if retries == 0:
-                    await channel.send("Max retries reached. Please start a new ticket.")
-                    return None, None
-                continue
-            break
-        except asyncio.TimeoutError:
-            await channel.send("Timed out waiting for confirmation.")
-            return None, None
+async def ticket_username_step(channel, ticket, content):
+    username = content
+    user_id = await get_roblox_user_id(username)
+    if not user_id:
+        await retry_ticket_step(channel, ticket, "Invalid username.")
+        return
+    verification_code = str(uuid.uuid4()).split("-")[0]
+    pending_verifications.add(username, ticket["discord_id"], verification_code)
+    response_cache.invalidate("profile", user_id)
+    ticket.update(state="confirm", retries=TICKET_MAX_RETRIES, username=username, roblox_id=user_id, code=verification_code)
+    ticket_store.save(ticket)
+    await channel.send(f"Add this code to your Roblox bio: `{verification_code}`\nReply with 'confirm' when done.")
 
-    del pending_verifications[username.lower()]
+async def ticket_confirm_step(channel, ticket, content):
+    if content.lower() != "confirm":
+        await retry_ticket_step(channel, ticket, "Please reply with 'confirm'.")
+        return
+    profile = await get_roblox_profile(ticket["roblox_id"], fresh=True)
+    if not profile or ticket["code"] not in profile.get("description", ""):
+        await retry_ticket_step(channel, ticket, "Code not found in bio.")
+        return
+    pending_verifications.remove(ticket["username"])
+    await account_links.link(ticket["discord_id"], ticket["roblox_id"], profile.get("name", ticket["username"]))
     await channel.send("Verification successful! Checking your ranks...")
+    await show_ticket_ranks(channel, ticket)
 
+async def show_ticket_ranks(channel, ticket):
     group_ids = [MAIN_GROUP_ID] + list(OTHER_KINGDOM_IDS.keys())
-    ranks = get_all_group_ranks(user_id, group_ids)
+    ranks = await get_all_group_ranks(ticket["roblox_id"], group_ids, fresh=True)
+    ticket.update(state="choice", retries=TICKET_MAX_RETRIES, ranks=list(ranks.items()))
+    ticket_store.save(ticket)
     ranks_text = "Your ranks:\n" + "\n".join(
         [f"{i}: {OTHER_KINGDOM_IDS.get(gid, 'Main Group')} - {rank}" for i, (gid, rank) in enumerate(ranks.items(), 1)]
     ) + "\nWhich group to transfer from? (Reply with number)"
     await channel.send(ranks_text)
 
-    retries = max_retries
-    while retries > 0:
+@timed
+async def get_role_id(group_id, rank_name):
+    data = await http_pool.get_json(f"{API_BASE_URL}/get_role_id?groupId={group_id}&rankName={rank_name}")
+    return data.get("roleId")
+
+async def resolve_role_id(group_id, rank_name):
+    # set_group_rank and RANK_TRANSFER_OVERRIDES both use the XP API's role ids, so that is the only source.
+    return await response_cache.fetch(("role_id", group_id, rank_name), functools.partial(get_role_id, group_id, rank_name))
+
+async def get_main_group_roles():
+    roles = await get_group_roles(MAIN_GROUP_ID)
+    names = list(roles)
+    role_ids = await asyncio.gather(*(resolve_role_id(MAIN_GROUP_ID, name) for name in names), return_exceptions=True)
+    main_roles = {}
+    for name, role_id in zip(names, role_ids):
+        if isinstance(role_id, UpstreamError):
+            logger.error(f"Error resolving Main Group role id for '{name}': {str(role_id)}")
+        elif isinstance(role_id, BaseException):
+            raise role_id
+        elif role_id is not None:
+            main_roles[name] = dict(roles[name], id=role_id)
+    return main_roles
+
+@timed
+async def set_group_rank(user_id, group_id, role_id):
+    payload = {"userId": user_id, "groupId": group_id, "roleId": role_id}
+    return await http_pool.request("POST", f"{API_BASE_URL}/set_group_rank", json=payload)
+
+class AccountLinks:
+    def __init__(self, conn):
+        self.conn = conn
+        conn.execute("CREATE TABLE IF NOT EXISTS account_links (discord_id INTEGER PRIMARY KEY, roblox_id INTEGER NOT NULL, linked_at REAL NOT NULL)")
+        if "username" not in [row[1] for row in conn.execute("PRAGMA table_info(account_links)")]:
+            conn.execute("ALTER TABLE account_links ADD COLUMN username TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS account_links_roblox_id ON account_links (roblox_id)")
+        conn.commit()
+
+    async def link(self, discord_id, roblox_id, username=None):
+        await db_writer.run(self.write_link, discord_id, roblox_id, username, time.time())
+
+    def write_link(self, conn, discord_id, roblox_id, username, linked_at):
+        # A Roblox account belongs to whoever verified it last.
+        conn.execute("DELETE FROM account_links WHERE roblox_id = ? AND discord_id != ?", (roblox_id, discord_id))
+        conn.execute(
+            "INSERT OR REPLACE INTO account_links (discord_id, roblox_id, username, linked_at) VALUES (?, ?, ?, ?)",
+            (discord_id, roblox_id, username, linked_at)
+        )
+
+    async def unlink(self, discord_id):
+        return await db_writer.execute("DELETE FROM account_links WHERE discord_id = ?", (discord_id,)) > 0
+
+    def get_by_discord(self, discord_id):
+        row = self.conn.execute("SELECT roblox_id, username FROM account_links WHERE discord_id = ?", (discord_id,)).fetchone()
+        return {"discord_id": discord_id, "roblox_id": row[0], "username": row[1]} if row else None
+
+    def get_by_roblox(self, roblox_id):
+        row = self.conn.execute("SELECT discord_id, username FROM account_links WHERE roblox_id = ?", (roblox_id,)).fetchone()
+        return {"discord_id": row[0], "roblox_id": roblox_id, "username": row[1]} if row else None
+
+    def roblox_ids(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT roblox_id FROM account_links")]
+
+account_links = AccountLinks(db)
+
+def pick_sync_role(ranks, main_roles):
+    current = ranks.get(MAIN_GROUP_ID, 'Not in group')
+    if current == 'Not in group':
+        return None
+    roles_by_id = {role["id"]: role for role in main_roles.values()}
+    best = main_roles.get(current)
+    if best is None:
+        return None
+    for group_id in OTHER_KINGDOM_IDS:
+        rank_name = ranks.get(group_id, 'Not in group')
+        if rank_name == 'Not in group':
+            continue
+        override = RANK_TRANSFER_OVERRIDES.get((group_id, rank_name))
+        role = roles_by_id.get(override) if override else main_roles.get(rank_name)
+        # Only ever promote: a kingdom rank below the current Main Group rank is left alone.
+        if role and role["rank"] > best["rank"]:
+            best = role
+    return best if best["name"] != current else None
+
+class RankSync:
+    def __init__(self, workers, fetch_concurrency, max_attempts, retry_delay):
+        self.worker_count = workers
+        self.fetch_slots = asyncio.Semaphore(fetch_concurrency)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue()
+        self.queued = set()
+        self.workers = []
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    async def run_once(self):
+        roblox_ids = account_links.roblox_ids()
+        main_roles = await get_main_group_roles()
+        if not main_roles:
+            logger.error("Skipping rank sync: Main Group roles unavailable")
+            return 0
+        group_ids = [MAIN_GROUP_ID] + list(OTHER_KINGDOM_IDS.keys())
+        queued = 0
+        for i in range(0, len(roblox_ids), RANK_SYNC_CHUNK):
+            chunk = roblox_ids[i:i + RANK_SYNC_CHUNK]
+            ranks = await asyncio.gather(*(self.fetch_ranks(roblox_id, group_ids) for roblox_id in chunk))
+            for roblox_id, user_ranks in zip(chunk, ranks):
+                role = pick_sync_role(user_ranks, main_roles)
+                if role and roblox_id not in self.queued:
+                    self.queued.add(roblox_id)
+                    self.queue.put_nowait((roblox_id, role))
+                    queued += 1
+        logger.info(f"Rank sync checked {len(roblox_ids)} linked accounts, queued {queued} transfers")
+        return queued
+
+    async def fetch_ranks(self, roblox_id, group_ids):
+        # A whole chunk at once would book seconds of the shared token bucket ahead of -data and tickets.
+        async with self.fetch_slots:
+            ranks = await rank_resolver.resolve([roblox_id], group_ids, fresh=True)
+        return ranks[roblox_id]
+
+    async def worker(self):
+        while True:
+            roblox_id, role = await self.queue.get()
+            try:
+                await self.apply(roblox_id, role)
+            except Exception as e:
+                logger.error(f"Error syncing rank for user {roblox_id}: {str(e)}")
+            finally:
+                self.queued.discard(roblox_id)
+                self.queue.task_done()
+
+    async def apply(self, roblox_id, role):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                status, result = await set_group_rank(roblox_id, MAIN_GROUP_ID, role["id"])
+                if status == 200 and result.get("status") == "success":
+                    response_cache.invalidate("ranks", roblox_id)
+                    metrics.inc("rank_sync_transfers_total", outcome="ok")
+                    logger.info(f"Rank sync set user {roblox_id} to '{role['name']}' in Main Group")
+                    return
+                error = f"{result.get('error', 'Unknown error')} - {result.get('details', 'No details provided')}"
+                if status < 500:
+                    break
+            except UpstreamError as e:
+                error = str(e)
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+        metrics.inc("rank_sync_transfers_total", outcome="failed")
+        logger.error(f"Rank sync failed to set user {roblox_id} to '{role['name']}': {error}")
+
+rank_sync = RankSync(RANK_SYNC_WORKERS, RANK_SYNC_FETCH_CONCURRENCY, RANK_SYNC_MAX_ATTEMPTS, RANK_SYNC_RETRY_DELAY)
+
+async def ticket_choice_step(channel, ticket, content):
+    try:
+        choice = int(content)
+    except ValueError:
+        await retry_ticket_step(channel, ticket, "Invalid input. Please enter a number.")
+        return
+    if not 1 <= choice <= len(ticket["ranks"]):
+        await retry_ticket_step(channel, ticket, "Invalid choice.")
+        return
+    source_group_id, source_rank = ticket["ranks"][choice - 1]
+    if source_group_id == MAIN_GROUP_ID:
+        await channel.send("Cannot transfer from Main Group. Choose another.")
+        return
+    if source_rank == "Not in group":
+        await end_ticket(channel, ticket, "You’re not in the selected group. Please join and retry.")
+        return
+    await channel.send(f"Transferring rank '{source_rank}' from {OTHER_KINGDOM_IDS.get(source_group_id, 'Unknown')} to Main Group...")
+    try:
+        target_role_id = RANK_TRANSFER_OVERRIDES.get((source_group_id, source_rank))
+        if target_role_id is None:
+            target_role_id = await resolve_role_id(MAIN_GROUP_ID, source_rank)
+            if target_role_id is None:
+                await end_ticket(channel, ticket, f"Rank '{source_rank}' not found in Main Group.")
+                return
+        status, result = await set_group_rank(ticket["roblox_id"], MAIN_GROUP_ID, target_role_id)
+    except UpstreamError as e:
+        error_msg = "Failed to set rank"
+        if isinstance(e.data, dict):
+            error_msg = f"{e.data.get('error', 'Unknown error')} - {e.data.get('details', 'No details provided')}"
+        elif e.status:
+            error_msg = str(e)
+        logger.error(f"Error setting group rank: {str(e)}")
+        await retry_ticket_step(channel, ticket, f"API error: {error_msg}.")
+        return
+    if status == 200 and result.get("status") == "success":
+        await end_ticket(channel, ticket, f"Successfully transferred rank '{source_rank}' to Main Group!")
+        return
+    error_msg = result.get('error', 'Unknown error')
+    error_details = result.get('details', 'No details provided')
+    logger.error(f"API error: {error_msg}, details={error_details}")
+    await retry_ticket_step(channel, ticket, f"Failed to transfer rank: {error_msg} - {error_details}.")
+
+TICKET_STEPS = {
+    "username": ticket_username_step,
+    "confirm": ticket_confirm_step,
+    "choice": ticket_choice_step
+}
+
+@bot.listen("on_message")
+async def dispatch_ticket_message(message):
+    ticket = ticket_store.get(message.channel.id)
+    if ticket is None or message.author.id != ticket["discord_id"]:
+        return
+    async with ticket_store.lock(message.channel.id):
+        # Re-read under the lock: an earlier message may have advanced or ended the ticket.
+        ticket = ticket_store.get(message.channel.id)
+        if ticket is None:
+            return
+        state = ticket["state"]
+        log_command.set(f"ticket:{state}")
+        log_user_id.set(message.author.id)
+        metrics.observe("ticket_reply_wait_seconds", max(time.time() - (ticket["expires_at"] - TICKET_STEP_TIMEOUT), 0), state=state)
+        start = time.perf_counter()
         try:
-            msg = await bot.wait_for("message", check=check, timeout=300)
-            choice = int(msg.content.strip())
-            group_list = list(ranks.keys())
-            if 1 <= choice <= len(group_list):
-                source_group_id = group_list[choice - 1]
-                source_rank = ranks[source_group_id]
-                if source_group_id == MAIN_GROUP_ID:
-                    await channel.send("Cannot transfer from Main Group. Choose another.")
-                    continue
-                if source_rank == "Not in group":
-                    await channel.send("You’re not in the selected group. Please join and retry.")
-                    return None, None
-                await channel.send(f"Transferring rank '{source_rank}' from {OTHER_KINGDOM_IDS.get(source_group_id, 'Unknown')} to Main Group...")
-                if source_group_id == 11592051 and source_rank == "Receptionist":
-                    target_role_id = 2
-                else:
-                    url = f"{API_BASE_URL}/get_role_id?groupId={MAIN_GROUP_ID}&rankName={source_rank}"
-                    resp = requests.get(url, timeout=10)
-                    resp.raise_for_status()
-                    data = resp.json()
-                    if "roleId" not in data:
-                        await channel.send(f"Rank '{source_rank}' not found in Main Group.")
-                        return None, None
-                    target_role_id = data["roleId"]
-                payload = {"userId": user_id, "groupId": MAIN_GROUP_ID, "roleId": target_role_id}
-                resp = requests.post(f"{API_BASE_URL}/set_group_rank", json=payload, timeout=10)
-                result = resp.json()
-                if resp.status_code == 200 and result.get("status") == "success":
-                    await channel.send(f"Successfully transferred rank '{source_rank}' to Main Group!")
-                else:
-                    error_msg = result.get('error', 'Unknown error')
-                    error_details = result.get('details', 'No details provided')
-                    await channel.send(f"Failed to transfer rank: {error_msg} - {error_details}. {retries - 1} retries left.")
-                    logger.error(f"API error: {error_msg}, details={error_details}")
-                retries -= 1
-                if retries == 0:
-                    await channel.send("Max retries reached. Please start a new ticket.")
-                return None, None
-            retries -= 1
-            await channel.send(f"Invalid choice. {retries} retries left.")
-            if retries == 0:
-                await channel.send("Max retries reached. Please start a new ticket.")
-                return None, None
-        except ValueError:
-            retries -= 1
-            await channel.send(f"Invalid input. Please enter a number. {retries} retries left.")
-            if retries == 0:
-                await channel.send("Max retries reached. Please start a new ticket.")
-            return None, None
-        except asyncio.TimeoutError:
-            retries -= 1
-            await channel.send(f"Timed out waiting for choice. {retries} retries left.")
-            if retries == 0:
-                await channel.send("Max retries reached. Please start a new ticket.")
-            return None, None
-        except requests.RequestException as e:
-            retries -= 1
-            error_msg = "Failed to set rank"
-            if e.response:
-                try:
-                    error_data = e.response.json()
-                    error_msg = error_data.get('error', 'Unknown error')
-                    error_details = error_data.get('details', 'No details provided')
-                    error_msg = f"{error_msg} - {error_details}"
-                except ValueError:
-                    error_msg = f"{e.response.status_code} - {e.response.text}"
-            await channel.send(f"API error: {error_msg}. {retries} retries left.")
-            logger.error(f"Error setting group rank: {str(e)}")
-            if retries == 0:
-                await channel.send("Max retries reached. Please start a new ticket.")
-            return None, None
-    return None, None
+            await TICKET_STEPS[state](message.channel, ticket, message.content.strip())
+            metrics.inc("ticket_steps_total", state=state, outcome="ok")
+        except Exception as e:
+            metrics.inc("ticket_steps_total", state=state, outcome="error")
+            logger.error(f"Error handling ticket step {ticket['state']} in channel {message.channel.id}: {str(e)}")
+            await message.channel.send("Something went wrong. Please try again.")
+        finally:
+            metrics.observe("ticket_step_duration_seconds", time.perf_counter() - start, state=state)
+
+@bot.listen("on_guild_channel_delete")
+async def forget_deleted_ticket(channel):
+    if ticket_store.get(channel.id):
+        ticket_store.delete(channel.id)
 
 class TicketView(discord.ui.View):
     def __init__(self):
@@ -435,23 +1979,166 @@ async def ranktransfer(ctx):
         logger.error(f"Error in ranktransfer command: {str(e)}")
         await ctx.send("Failed to initiate rank transfer.")
 
-@tasks.loop(minutes=30)
-async def clean_verifications():
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]}s"
+    return f"<={value * 1000:.0f}ms" if value < 1 else f"<={value:g}s"
+
+@bot.command()
+@commands.has_any_role(*XP_EDITOR_ROLES)
+async def stats(ctx):
+    embed = discord.Embed(title="Bot Stats", color=discord.Color.dark_grey())
+    command_lines = []
+    for labels in sorted(metrics.label_sets("command_duration_seconds"), key=lambda l: l["command"]):
+        if labels["status"] != "ok":
+            continue
+        name = labels["command"]
+        errors = metrics.counters.get(("commands_total", (("command", name), ("status", "error"))), 0)
+        command_lines.append(
+            f"`{name}` p50 {format_seconds(metrics.quantile('command_duration_seconds', 0.5, **labels))} "
+            f"p99 {format_seconds(metrics.quantile('command_duration_seconds', 0.99, **labels))} errors {errors:g}"
+        )
+    embed.add_field(name="Commands", value="\n".join(command_lines) or "No commands yet", inline=False)
+    upstream_lines = []
+    for labels in sorted(metrics.label_sets("upstream_request_duration_seconds"), key=lambda l: (l["host"], l["method"])):
+        host = labels["host"]
+        failures = sum(v for (n, l), v in metrics.counters.items() if n == "upstream_requests_total" and dict(l)["host"] == host and dict(l)["outcome"] in UPSTREAM_FAILURE_OUTCOMES)
+        upstream_lines.append(
+            f"`{host}` {labels['method']} p50 {format_seconds(metrics.quantile('upstream_request_duration_seconds', 0.5, **labels))} "
+            f"p99 {format_seconds(metrics.quantile('upstream_request_duration_seconds', 0.99, **labels))} "
+            f"failures {failures:g} circuit {http_pool.breaker_for(host).state}"
+        )
+    embed.add_field(name="Upstream", value="\n".join(upstream_lines)[:1024] or "No requests yet", inline=False)
+    lookups = response_cache.hits + response_cache.stale_hits + response_cache.misses
+    hit_rate = (response_cache.hits + response_cache.stale_hits) / lookups * 100 if lookups else 0
+    embed.add_field(name="Cache", value=f"{len(response_cache.entries)} entries, {hit_rate:.1f}% hit rate ({response_cache.stale_hits} stale, {response_cache.fallbacks} fallbacks)", inline=False)
+    embed.add_field(name="Event Loop Lag", value=f"p99 {format_seconds(metrics.quantile('event_loop_lag_seconds', 0.99))}", inline=True)
+    embed.add_field(name="Open Tickets", value=len(ticket_store.tickets), inline=True)
+    verification_stats = pending_verifications.stats()
+    embed.add_field(name="Pending Verifications", value=f"{verification_stats['size']} ({verification_stats['evictions']} expired)", inline=True)
+    await ctx.send(embed=embed)
+
+@bot.listen("on_command")
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@bot.before_invoke
+async def bind_log_context(ctx):
+    # Hooks run in the command's own task, so everything it logs or spawns carries these.
+    log_command.set(ctx.command.qualified_name)
+    log_user_id.set(ctx.author.id)
+
+@bot.listen("on_command_completion")
+async def record_command_success(ctx):
+    record_command(ctx, "ok")
+
+def record_command(ctx, status):
+    started_at = getattr(ctx, "started_at", None)
+    if ctx.command is None or started_at is None:
+        return
+    elapsed = time.perf_counter() - started_at
+    metrics.inc("commands_total", command=ctx.command.name, status=status)
+    metrics.observe("command_duration_seconds", elapsed, command=ctx.command.name, status=status)
+    logger.info(
+        f"Command {ctx.command.name} finished: {status}",
+        extra={"command": ctx.command.qualified_name, "user_id": ctx.author.id, "latency_ms": round(elapsed * 1000, 1)}
+    )
+
+async def measure_event_loop_lag():
+    # Anything blocking the loop delays this wake-up, so the overshoot is the lag.
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        metrics.observe("event_loop_lag_seconds", max(time.monotonic() - start - EVENT_LOOP_LAG_INTERVAL, 0))
+
+async def serve_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+async def start_metrics_server():
+    metrics.gauge("cache_entries", lambda: len(response_cache.entries))
+    metrics.gauge("cache_lookups_total", lambda: {
+        (("result", "hit"),): response_cache.hits,
+        (("result", "stale"),): response_cache.stale_hits,
+        (("result", "miss"),): response_cache.misses,
+        (("result", "fallback"),): response_cache.fallbacks
+    })
+    metrics.gauge("open_tickets", lambda: len(ticket_store.tickets))
+    metrics.gauge("pending_verifications", lambda: len(pending_verifications))
+    metrics.gauge("verification_evictions_total", lambda: pending_verifications.evictions)
+    metrics.gauge("circuit_open", lambda: {(("host", host),): int(breaker.state != "closed") for host, breaker in http_pool.breakers.items()})
+    if not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
     try:
-        now = datetime.datetime.utcnow()
-        expired = [k for k, v in pending_verifications.items() if (now - datetime.datetime.fromisoformat(v["timestamp"])).total_seconds() > 3600]
-        for k in expired:
-            del pending_verifications[k]
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        logger.error(f"Could not start metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {str(e)}")
+        await runner.cleanup()
+        return
+    metrics.server = runner
+    logger.info(f"Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+@bot.command()
+@commands.has_any_role(*XP_EDITOR_ROLES)
+async def unlink(ctx, member: discord.User):
+    if await account_links.unlink(member.id):
+        await ctx.send(f"Unlinked {member.mention}'s Roblox account. They will need to verify again in their next ticket.")
+    else:
+        await ctx.send(f"{member.mention} has no linked Roblox account.")
+
+@bot.command()
+@commands.has_any_role(*XP_EDITOR_ROLES)
+async def relink(ctx, member: discord.User, username: str):
+    user_id = await get_roblox_user_id(username)
+    if not user_id:
+        await ctx.send(f"Could not find Roblox user {username}.")
+        return
+    profile = await get_roblox_profile(user_id)
+    if profile:
+        username = profile.get("name", username)
+    previous = account_links.get_by_roblox(user_id)
+    await account_links.link(member.id, user_id, username)
+    note = f" (was linked to <@{previous['discord_id']}>)" if previous and previous["discord_id"] != member.id else ""
+    await ctx.send(f"Linked {member.mention} to Roblox user {username}{note}.")
+
+@tasks.loop(minutes=RANK_SYNC_MINUTES or 30)
+async def sync_ranks():
+    try:
+        await rank_sync.run_once()
     except Exception as e:
-        logger.error(f"Error cleaning verifications: {str(e)}")
+        logger.error(f"Error running rank sync: {str(e)}")
+
+@tasks.loop(seconds=LEADERBOARD_REFRESH_SECONDS)
+async def refresh_leaderboard():
+    try:
+        await leaderboard_cache.refresh()
+    except UpstreamError as e:
+        logger.error(f"Error refreshing leaderboard: {str(e)}")
+
+@bot.event
+async def setup_hook():
+    bot.add_view(TicketView())
+    ticket_store.resume_all()
+    await start_metrics_server()
+    asyncio.create_task(measure_event_loop_lag())
 
 @bot.event
 async def on_ready():
     logger.info(f"Bot logged in as {bot.user}")
-    clean_verifications.start()
+    if not refresh_leaderboard.is_running():
+        refresh_leaderboard.start()
+    if RANK_SYNC_MINUTES and is_primary_process() and not sync_ranks.is_running():
+        rank_sync.start()
+        sync_ranks.start()
 
 @bot.event
 async def on_command_error(ctx, error):
+    record_command(ctx, "error")
     if isinstance(error, commands.MissingAnyRole):
         await ctx.send("You don’t have permission to use this command.")
     elif isinstance(error, commands.CommandNotFound):
@@ -466,4 +2153,14 @@ if __name__ == "__main__":
     if not TOKEN:
         logger.error("DISCORD_BOT_TOKEN not found in environment variables.")
         raise ValueError("DISCORD_BOT_TOKEN not set!")
-    bot.run(TOKEN)
+
+    async def main():
+        async with bot:
+            try:
+                await bot.start(TOKEN)
+            finally:
+                await http_pool.close()
+                if metrics.server:
+                    await metrics.server.cleanup()
+
+    asyncio.run(main())